@@ -0,0 +1,302 @@
+""" Stateless batch analysis of recorded Teeko positions.
+
+No TeekoPlayer is involved: every position is searched on its own with a fresh
+search state, so the results do not depend on batch order, chunking or the
+number of workers.
+
+Positions can be given as any of:
+    - list-of-lists boards as used by TeekoPlayer ('b', 'r' and ' ');
+    - sequences of 25 cell codes (EMPTY, BLACK or RED), row by row;
+    - an (N, 25) integer NumPy array of cell codes.
+The side to move is 'b'/'r' or BLACK/RED, one per position. It may be omitted
+for drop-phase positions, where the piece counts decide it.
+
+Example:
+    moves, values = analyse(boards, sides, depth=5, workers=8)
+    for index, move, value in iter_analysis(dump, sides, depth=5):
+        ...
+
+With NumPy installed the module also scores whole batches without searching:
+batch_game_value and batch_heuristic reproduce TeekoPlayer.game_value and
+heuristic_game_value for an (N, 25) array of boards at once.
+"""
+import itertools
+import os
+
+import TeekoGame
+from TeekoGame import SearchBoard, SearchEngine, WIN_SCORE, bb_is_win, bits_from_board
+
+# Cell codes of the array encoding.
+EMPTY, BLACK, RED = 0, 1, 2
+_PIECE_CODES = {'b': BLACK, 'r': RED, BLACK: BLACK, RED: RED}
+
+
+def position_bits(position):
+    """ Converts one position to (black, red) bitboards.
+
+    Args:
+        position: a list-of-lists board or a sequence of 25 cell codes
+
+    Returns:
+        tuple: (black, red) bitboards
+    """
+    if len(position) == TeekoGame.BOARD_SIZE and len(position[0]) == TeekoGame.BOARD_SIZE:
+        return bits_from_board(position, 'b'), bits_from_board(position, 'r')
+    black = red = 0
+    for cell, code in enumerate(position):
+        if code == BLACK:
+            black |= 1 << cell
+        elif code == RED:
+            red |= 1 << cell
+    return black, red
+
+
+def side_to_move(black, red, side=None):
+    """ Resolves the side to move of a position to BLACK or RED.
+
+    Raises:
+        ValueError: if side is None and the position is in the move phase,
+            where the board alone does not say whose turn it is
+    """
+    if side is not None:
+        return _PIECE_CODES[side]
+    if black.bit_count() + red.bit_count() >= 2 * TeekoGame.PIECES_PER_SIDE:
+        raise ValueError("the side to move is required for move-phase positions")
+    return BLACK if black.bit_count() == red.bit_count() else RED
+
+
+def analyse_position(engine, black, red, side, depth, time_limit=None):
+    """ Searches one position with engine, after clearing its state.
+
+    Returns:
+        tuple: (src, dst, value) where src is -1 for drops, dst is -1 if there is
+            nothing to play (the game is already over or the side to move is
+            blocked) and value is from the side to move's point of view
+    """
+    mine, theirs = (black, red) if side == BLACK else (red, black)
+    if bb_is_win(theirs):
+        return -1, -1, -WIN_SCORE
+    if bb_is_win(mine):
+        return -1, -1, WIN_SCORE
+    engine.clear()
+    if time_limit is None:
+        value, move = engine.search(mine, theirs, depth)
+    else:
+        value, move = engine.iterative_deepening(mine, theirs, time_limit, depth)
+    if move is None:
+        return -1, -1, SearchBoard(mine, theirs).evaluate()
+    src, dst = move
+    return (-1 if src is None else src), dst, value
+
+
+# Each worker process keeps one SearchEngine for its lifetime; analyse_position
+# clears it before every position.
+_worker_engine = None
+
+
+def _worker_init(tt_size_mb):
+    global _worker_engine
+    _worker_engine = SearchEngine(tt_size_mb)
+
+
+def _analyse_chunk(args):
+    chunk, depth, time_limit = args
+    return [analyse_position(_worker_engine, black, red, side, depth, time_limit)
+            for black, red, side in chunk]
+
+
+def _prepared(positions, sides):
+    if sides is None:
+        sides = itertools.repeat(None)
+    for position, side in zip(positions, sides):
+        black, red = position_bits(position)
+        yield black, red, side_to_move(black, red, side)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_analysis(positions, sides=None, depth=4, time_limit=None, workers=1, chunksize=64,
+                  tt_size_mb=1):
+    """ Streams the analysis of positions in input order.
+
+    Args:
+        positions (iterable): positions in any of the encodings listed above
+        sides (iterable): side to move of each position, or None to infer it
+        depth (int): search depth (the maximum depth if time_limit is given)
+        time_limit (float): optional per-position budget in seconds; results
+            then depend on machine speed
+        workers (int): processes to spread the work over; None means one per CPU
+        chunksize (int): positions sent to a worker at a time
+        tt_size_mb (float): transposition table budget of each worker
+
+    Yields:
+        tuple: (index, (src, dst), value) with src -1 for drops and dst -1 when
+            there is no move
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunks(_prepared(positions, sides), chunksize)
+    index = 0
+    if workers == 1:
+        engine = SearchEngine(tt_size_mb)
+        for chunk in chunks:
+            for black, red, side in chunk:
+                src, dst, value = analyse_position(engine, black, red, side, depth, time_limit)
+                yield index, (src, dst), value
+                index += 1
+        return
+    from multiprocessing import Pool
+    with Pool(workers, initializer=_worker_init, initargs=(tt_size_mb,)) as pool:
+        for results in pool.imap(_analyse_chunk, ((chunk, depth, time_limit) for chunk in chunks)):
+            for src, dst, value in results:
+                yield index, (src, dst), value
+                index += 1
+
+
+def analyse(positions, sides=None, depth=4, time_limit=None, workers=1, chunksize=64, tt_size_mb=1):
+    """ Analyses a batch of positions; see iter_analysis for the arguments.
+
+    Returns:
+        tuple: (moves, values). With NumPy installed these are an (N, 2) int8
+            array of (src, dst) cell indices and an (N,) float64 array, otherwise
+            an array.array('b') of 2N interleaved cell indices and an
+            array.array('d').
+    """
+    from array import array
+    moves = array('b')
+    values = array('d')
+    for _, (src, dst), value in iter_analysis(positions, sides, depth, time_limit, workers,
+                                              chunksize, tt_size_mb):
+        moves.append(src)
+        moves.append(dst)
+        values.append(value)
+    try:
+        import numpy as np
+    except ImportError:
+        return moves, values
+    return np.frombuffer(moves, dtype=np.int8).reshape(-1, 2).copy(), np.frombuffer(values, dtype=np.float64).copy()
+
+
+############################################################################
+#
+# VECTORISED EVALUATION (requires NumPy)
+#
+############################################################################
+# Boards are encoded as an (N, 25) integer array of cell codes. Multiplying the
+# one-hot planes of both colours by the (25, 44) cell/pattern incidence matrix
+# gives every colour's piece count in every winning pattern for all N boards in
+# one product, from which game_value and heuristic_game_value follow directly.
+_line_incidence = None
+
+
+def line_incidence():
+    """ The (25, 44) int8 matrix with a 1 where a cell belongs to a winning
+    pattern, columns in WIN_MASKS order.
+    """
+    global _line_incidence
+    if _line_incidence is None:
+        import numpy as np
+        masks = np.array(TeekoGame.WIN_MASKS, dtype=np.int64)
+        cells = np.arange(TeekoGame.NUM_CELLS, dtype=np.int64)
+        _line_incidence = ((masks[None, :] >> cells[:, None]) & 1).astype(np.int8)
+    return _line_incidence
+
+
+def encode_boards(positions):
+    """ Encodes positions (in any of the accepted forms) as an (N, 25) int8 array """
+    import numpy as np
+    if isinstance(positions, np.ndarray):
+        return positions.reshape(-1, TeekoGame.NUM_CELLS).astype(np.int8, copy=False)
+    boards = []
+    for position in positions:
+        black, red = position_bits(position)
+        boards.append([BLACK if black >> cell & 1 else RED if red >> cell & 1 else EMPTY
+                       for cell in range(TeekoGame.NUM_CELLS)])
+    return np.array(boards, dtype=np.int8).reshape(-1, TeekoGame.NUM_CELLS)
+
+
+def batch_line_counts(boards):
+    """ Piece counts per pattern.
+
+    Args:
+        boards (ndarray): (N, 25) cell codes
+
+    Returns:
+        ndarray: (N, 2, 44) counts, [:, 0] for black and [:, 1] for red
+    """
+    import numpy as np
+    planes = np.stack([boards == BLACK, boards == RED], axis=1).astype(np.int8)
+    return planes @ line_incidence()
+
+
+def _perspective(counts, piece):
+    if _PIECE_CODES[piece] == BLACK:
+        return counts[:, 0], counts[:, 1]
+    return counts[:, 1], counts[:, 0]
+
+
+def batch_game_value(boards, piece, counts=None):
+    """ Vectorised TeekoPlayer.game_value for a player of colour piece.
+
+    Args:
+        boards (ndarray): (N, 25) cell codes
+        piece: 'b'/'r' or BLACK/RED
+        counts (ndarray): batch_line_counts(boards), if already computed
+
+    Returns:
+        ndarray: (N,) int8 of 1 (piece has won), -1 (the other colour has won) or 0
+    """
+    import numpy as np
+    if counts is None:
+        counts = batch_line_counts(boards)
+    mine, theirs = _perspective(counts, piece)
+    full = TeekoGame.PIECES_PER_SIDE
+    return np.where((mine == full).any(axis=1), 1,
+                    np.where((theirs == full).any(axis=1), -1, 0)).astype(np.int8)
+
+
+def batch_heuristic(boards, piece, counts=None):
+    """ Vectorised TeekoPlayer.heuristic_game_value for a player of colour piece.
+
+    Returns:
+        ndarray: (N,) float64 heuristic values
+    """
+    import numpy as np
+    if counts is None:
+        counts = batch_line_counts(boards)
+    mine, theirs = _perspective(counts, piece)
+    my_score = mine.max(axis=1).astype(np.float64)
+    opp_score = theirs.max(axis=1).astype(np.float64)
+    return np.where(my_score >= opp_score, my_score / 4, opp_score / -4)
+
+
+def expand_ply(mine, theirs, moves=None):
+    """ Builds the boards reached by every move of the side owning mine, for
+    evaluating a whole ply with batch_game_value/batch_heuristic. The mover is
+    encoded as BLACK.
+
+    Args:
+        mine (int): bitboard of the side to move
+        theirs (int): bitboard of the other side
+        moves (list): (src, dst) moves; defaults to all legal moves
+
+    Returns:
+        tuple: (moves, boards) with boards an (len(moves), 25) int8 array
+    """
+    import numpy as np
+    if moves is None:
+        moves = TeekoGame.bb_moves(mine, theirs)
+    cells = np.arange(TeekoGame.NUM_CELLS)
+    base = np.where((mine >> cells) & 1, BLACK, np.where((theirs >> cells) & 1, RED, EMPTY))
+    boards = np.repeat(base[None, :].astype(np.int8), len(moves), axis=0)
+    for row, (src, dst) in enumerate(moves):
+        if src is not None:
+            boards[row, src] = EMPTY
+        boards[row, dst] = BLACK
+    return moves, boards
@@ -0,0 +1,417 @@
+""" Headless self-play arena: plays engine variants against each other and
+reports which is stronger.
+
+Every game starts from a random opening of a few drops, and each opening is
+played twice with the colours swapped, so neither variant profits from a lucky
+opening or from moving first. Each player is a TeekoPlayer with its own board.
+Every move is checked twice: the opponent's opponent_move validates it, and the
+arena checks that it fits the game phase (a drop while fewer than eight pieces
+are on the board, a one-step slide afterwards). An illegal move, an exception,
+or a move slower than the time limit plus --time-margin loses the game. A game
+is drawn when a position repeats for the third time or when it reaches
+--max-plies.
+
+Results are given from the first variant's point of view as W/D/L, an Elo
+difference with a 95% confidence interval and, with --sprt, a sequential
+probability ratio test between --elo0 and --elo1 that stops the match as soon as
+it is decided.
+
+Variants are given as comma-separated key=value lists:
+    name      label in the output (default: variant1, variant2)
+    time      seconds per move (default 0.1)
+    depth     search depth limit (default: no limit)
+    book      use the opening book, 0 or 1 (default 1)
+    tablebase use the endgame tablebase, 0 or 1 (default 1)
+    module    path to another TeekoGame.py to take TeekoPlayer from, e.g. a
+              copy of the previous version (default: this one)
+
+Usage:
+    python TeekoArena.py [--games 1000] [--workers N] [--opening-plies 4]
+                         [--variant name=new,time=0.1] [--variant name=old,module=old/TeekoGame.py]
+                         [--sprt --elo0 0 --elo1 10] [--records games.txt] [--seed 1]
+                         [--archive games.tkg]
+
+Each game is written to --records as one tab-separated line:
+    game  black  red  result  reason  plies  moves
+where result is 1-0, 0-1 or 1/2-1/2 (black first), reason is one of win, illegal,
+time, error, repetition or maxplies, and moves are space-separated in main()'s notation:
+a drop is its destination ("C2") and a slide is source and destination ("B3C3").
+--archive also appends every game to a binary record file, see TeekoRecords.py.
+"""
+import argparse
+import importlib.util
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+import TeekoGame
+
+Variant = namedtuple('Variant', 'name time_limit depth_limit book tablebase module')
+
+# Default slack on top of the time limit before a move loses on time. The search
+# looks at the clock every 1024 nodes, so it overshoots by a few milliseconds.
+TIME_MARGIN = 0.1
+MAX_PLIES = 200
+
+WIN, DRAW, LOSS = 1.0, 0.5, 0.0
+
+
+def parse_variant(spec, index=0):
+    """ Builds a Variant from a "key=value,key=value" string """
+    fields = {'name': 'variant%d' % (index + 1), 'time': '0.1', 'depth': None,
+              'book': '1', 'tablebase': '1', 'module': None}
+    for item in filter(None, spec.split(',')):
+        key, sep, value = item.partition('=')
+        if not sep or key not in fields:
+            raise ValueError("bad variant setting %r" % item)
+        fields[key] = value
+    return Variant(fields['name'], float(fields['time']),
+                   int(fields['depth']) if fields['depth'] else None,
+                   fields['book'] != '0', fields['tablebase'] != '0', fields['module'])
+
+
+_modules = {}
+
+
+def player_class(module):
+    """ TeekoPlayer from the TeekoGame module at path module, or from this one """
+    if module is None:
+        return TeekoGame.TeekoPlayer
+    path = os.path.abspath(module)
+    if path not in _modules:
+        spec = importlib.util.spec_from_file_location('arena_variant_%d' % len(_modules), path)
+        _modules[path] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_modules[path])
+    return _modules[path].TeekoPlayer
+
+
+def make_player(variant, piece):
+    """ A TeekoPlayer configured as variant, playing piece """
+    player = player_class(variant.module)()
+    player.my_piece = piece
+    player.opp = 'r' if piece == 'b' else 'b'
+    if 'board' not in vars(player):
+        # players from older modules keep one board for the whole class
+        player.board = [[' ' for j in range(5)] for i in range(5)]
+    player.time_limit = variant.time_limit
+    if variant.depth_limit is not None:
+        player.depth_limit = variant.depth_limit
+    if not variant.book:
+        player.book = None
+    if not variant.tablebase:
+        player.tablebase = None
+        # players from older modules may have no engine
+        engine = getattr(player, 'engine', None)
+        if engine is not None:
+            engine.tablebase = None
+    return player
+
+
+def random_opening(plies, rng):
+    """ A list of plies random drops, none of which wins """
+    black = red = 0
+    moves = []
+    while len(moves) < plies:
+        empty = [cell for cell in range(TeekoGame.NUM_CELLS) if not (black | red) >> cell & 1]
+        cell = rng.choice(empty)
+        if len(moves) % 2:
+            if TeekoGame.bb_is_win(red | 1 << cell):
+                continue
+            red |= 1 << cell
+        else:
+            if TeekoGame.bb_is_win(black | 1 << cell):
+                continue
+            black |= 1 << cell
+        moves.append([divmod(cell, 5)])
+    return moves
+
+
+def format_move(move):
+    return ''.join(chr(col + ord('A')) + str(row) for row, col in reversed(move))
+
+
+def check_phase(move, board):
+    """ Raises ValueError unless move has the shape the phase requires; the
+    remaining checks are opponent_move's.
+    """
+    pieces = sum(cell != ' ' for row in board for cell in row)
+    if pieces < 8:
+        if len(move) != 1:
+            raise ValueError("a piece must be dropped while fewer than 8 are on the board")
+    elif len(move) != 2 or move[1] is None or move[1][0] is None:
+        raise ValueError("pieces must be moved once all 8 are on the board")
+    elif move[0] == move[1]:
+        raise ValueError("a piece must move to a different cell")
+    for row, col in move:
+        if not (0 <= row < 5 and 0 <= col < 5):
+            raise ValueError("cell off the board")
+
+
+def play_game(game, black, red, opening, time_margin=TIME_MARGIN, max_plies=MAX_PLIES):
+    """ Plays one game.
+
+    Args:
+        game (int): game number, for the record
+        black (Variant): the variant playing black, which moves first
+        red (Variant): the variant playing red
+        opening (list): moves both players make first, in TeekoPlayer format
+        time_margin (float): slack on top of each variant's time limit
+        max_plies (int): game length at which the game is drawn; it is also
+            drawn when the same position occurs for the third time
+
+    Returns:
+        tuple: (game, black name, red name, black's score, reason, moves made)
+    """
+    variants = (black, red)
+    players = (make_player(black, 'b'), make_player(red, 'r'))
+    moves = []
+    seen = {}
+    score, reason = DRAW, 'maxplies'
+    for ply in range(max_plies):
+        turn = ply % 2
+        mover, other = players[turn], players[1 - turn]
+        loss = LOSS if turn == 0 else WIN
+        if ply < len(opening):
+            move = opening[ply]
+        else:
+            start = time.perf_counter()
+            try:
+                move = mover.make_move(mover.board)
+            except Exception:
+                score, reason = loss, 'error'
+                break
+            if time.perf_counter() - start > variants[turn].time_limit + time_margin:
+                score, reason = loss, 'time'
+                break
+        try:
+            move = [tuple(cell) for cell in move]
+            check_phase(move, other.board)
+            other.opponent_move(move)
+        except Exception:
+            score, reason = loss, 'illegal'
+            break
+        mover.place_piece(move, mover.my_piece)
+        moves.append(move)
+        if mover.game_value(mover.board) == 1:
+            score, reason = 1 - loss, 'win'
+            break
+        position = (turn, tuple(map(tuple, mover.board)))
+        seen[position] = seen.get(position, 0) + 1
+        if seen[position] == 3:
+            score, reason = DRAW, 'repetition'
+            break
+    return game, black.name, red.name, score, reason, moves
+
+
+def _play_game(args):
+    return play_game(*args)
+
+
+def format_record(game, black, red, score, reason, moves):
+    result = {WIN: '1-0', DRAW: '1/2-1/2', LOSS: '0-1'}[score]
+    return '\t'.join([str(game), black, red, result, reason, str(len(moves)),
+                      ' '.join(format_move(move) for move in moves)])
+
+
+def schedule(variants, games, opening_plies, seed):
+    """ Yields play_game arguments: each random opening twice, colours swapped """
+    rng = random.Random(seed)
+    first, second = variants
+    for game in range(games):
+        if game % 2 == 0:
+            opening = random_opening(opening_plies, rng)
+            yield game, first, second, opening
+        else:
+            yield game, second, first, opening
+
+
+def elo(score):
+    """ Elo difference corresponding to an expected score """
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+class MatchStats:
+    """ Running W/D/L totals of a match, from the first variant's point of view.
+
+    Attributes:
+        wins (int), draws (int), losses (int): game results
+        reasons (dict): number of games per end reason
+    """
+
+    def __init__(self):
+        self.wins = self.draws = self.losses = 0
+        self.reasons = {}
+
+    def add(self, score, reason):
+        """ Records a game the first variant scored score in """
+        if score == WIN:
+            self.wins += 1
+        elif score == LOSS:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def score(self):
+        return (self.wins + self.draws / 2) / self.games
+
+    def variance(self):
+        """ Per-game variance of the score """
+        s = self.score()
+        return (self.wins * (1 - s) ** 2 + self.draws * (0.5 - s) ** 2
+                + self.losses * s ** 2) / self.games
+
+    def elo(self):
+        """
+        Returns:
+            tuple: (Elo difference, 95% margin)
+        """
+        s = self.score()
+        error = 1.96 * math.sqrt(self.variance() / self.games)
+        return elo(s), (elo(s + error) - elo(s - error)) / 2
+
+    def llr(self, elo0, elo1):
+        """ Log-likelihood ratio of elo1 against elo0, using the usual normal
+        approximation of the trinomial model.
+        """
+        variance = self.variance()
+        if not self.games or variance == 0:
+            return 0.0
+        s0 = 1 / (1 + 10 ** (-elo0 / 400))
+        s1 = 1 / (1 + 10 ** (-elo1 / 400))
+        return (s1 - s0) * (2 * self.score() - s0 - s1) * self.games / (2 * variance)
+
+    def __str__(self):
+        text = "%d games: +%d =%d -%d" % (self.games, self.wins, self.draws, self.losses)
+        if self.games:
+            diff, margin = self.elo()
+            text += ", score %.3f, Elo %+.1f +/- %.1f" % (self.score(), diff, margin)
+        return text
+
+
+def sprt_bounds(alpha, beta):
+    """ Lower and upper LLR bounds of an SPRT with error rates alpha and beta """
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def run_match(variants, games, workers=1, opening_plies=4, seed=None, time_margin=TIME_MARGIN,
+              max_plies=MAX_PLIES, sprt=None, on_game=None):
+    """ Plays a match between two variants.
+
+    Args:
+        variants (tuple): the two Variants; statistics are from the first one's side
+        games (int): number of games; rounded up to an even number
+        workers (int): processes to play games in
+        opening_plies (int): random drops at the start of every opening
+        seed (int): seed of the opening generator
+        time_margin (float): slack on top of the time limit per move
+        max_plies (int): game length at which a game is drawn
+        sprt (tuple): (elo0, elo1, alpha, beta) to stop as soon as the test is decided
+        on_game (callable): called with (record line, MatchStats) after every game
+
+    Returns:
+        MatchStats: the totals
+    """
+    games += games % 2
+    stats = MatchStats()
+    bounds = sprt_bounds(*sprt[2:]) if sprt else None
+    jobs = ((game, black, red, opening, time_margin, max_plies)
+            for game, black, red, opening in schedule(variants, games, opening_plies, seed))
+    first = variants[0].name
+
+    def record(result):
+        game, black, red, score, reason, moves = result
+        stats.add(score if black == first else 1 - score, reason)
+        if on_game:
+            on_game(format_record(*result), stats)
+        if bounds:
+            llr = stats.llr(*sprt[:2])
+            return not bounds[0] < llr < bounds[1]
+        return False
+
+    if workers <= 1:
+        for job in jobs:
+            if record(play_game(*job)):
+                break
+        return stats
+    from multiprocessing import Pool
+    with Pool(workers) as pool:
+        for result in pool.imap_unordered(_play_game, jobs):
+            if record(result):
+                pool.terminate()
+                break
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--variant', action='append', default=[],
+                        help="engine settings, see above; give it twice")
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--opening-plies', type=int, default=4)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--time-margin', type=float, default=TIME_MARGIN)
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES)
+    parser.add_argument('--sprt', action='store_true')
+    parser.add_argument('--elo0', type=float, default=0)
+    parser.add_argument('--elo1', type=float, default=10)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--records', help="file to append game records to")
+    parser.add_argument('--archive', help="binary record file to append games to")
+    args = parser.parse_args(argv)
+    if len(args.variant) > 2:
+        parser.error("at most two variants")
+    specs = args.variant + [''] * (2 - len(args.variant))
+    variants = tuple(parse_variant(spec, index) for index, spec in enumerate(specs))
+    if variants[0].name == variants[1].name:
+        parser.error("the two variants need different names")
+    sprt = (args.elo0, args.elo1, args.alpha, args.beta) if args.sprt else None
+
+    records = open(args.records, 'a') if args.records else None
+    archive = None
+    if args.archive:
+        import TeekoRecords
+        archive = TeekoRecords.GameWriter.open(args.archive, validate=False)
+
+    def on_game(line, stats):
+        if records:
+            records.write(line + '\n')
+        if archive:
+            archive.write(*TeekoRecords.parse_arena_record(line))
+        if stats.games % 10 == 0:
+            progress = str(stats)
+            if sprt:
+                progress += ", LLR %.2f" % stats.llr(args.elo0, args.elo1)
+            print(progress, file=sys.stderr)
+
+    try:
+        stats = run_match(variants, args.games, args.workers, args.opening_plies, args.seed,
+                          args.time_margin, args.max_plies, sprt, on_game)
+    finally:
+        if records:
+            records.close()
+        if archive:
+            archive.close()
+    print("%s vs %s" % (variants[0].name, variants[1].name))
+    print(stats)
+    print("end reasons: " + ", ".join("%s %d" % item for item in sorted(stats.reasons.items())))
+    if sprt:
+        lower, upper = sprt_bounds(args.alpha, args.beta)
+        llr = stats.llr(args.elo0, args.elo1)
+        verdict = "H1 accepted" if llr >= upper else "H0 accepted" if llr <= lower else "undecided"
+        print("SPRT elo0=%g elo1=%g: LLR %.2f [%.2f, %.2f] %s"
+              % (args.elo0, args.elo1, llr, lower, upper, verdict))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+""" Benchmarks for the Teeko engine, run against a fixed corpus of positions.
+
+Measures search speed (nodes per second and time for iterative deepening to
+reach a fixed depth), make_move, and the per-call cost of succ, game_value and
+heuristic_game_value, separately for drop-phase and move-phase positions. The
+results can be compared with a stored baseline so that each engine change is
+judged on numbers. Only the standard library is used.
+
+Startup is measured too: startup.first_move.<phase> is the time from launching
+a fresh interpreter until it has printed the make_move result for the phase's
+first corpus position. startup.interpreter is the same for an empty script, the
+floor that no change to the engine can go below.
+
+Usage:
+    python TeekoBenchmark.py [--corpus benchmark_positions.txt] [--depth 5]
+                             [--baseline benchmark_baseline.json] [--save-baseline]
+                             [--threshold 0.15] [--metric-threshold NAME=FRACTION ...]
+                             [--output results.json] [--startup-only]
+
+With a baseline, every metric that got worse by more than its threshold (a
+fraction of the baseline value) is reported as a regression and the exit status
+is 1. Thresholds come from, in increasing priority: --threshold, the baseline
+file's "thresholds" object and --metric-threshold. Timings vary between machines,
+so a baseline is only meaningful on the machine that recorded it.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+from TeekoGame import SearchEngine, TeekoPlayer, bits_from_board
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_FILE = os.path.join(HERE, 'benchmark_positions.txt')
+BASELINE_FILE = os.path.join(HERE, 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.15
+PHASES = ('drop', 'move')
+STARTUP_RUNS = 11
+# Run by a fresh interpreter for the startup benchmark; the parent stops the clock
+# when the move arrives. The search is held to depth 1 so that it times getting
+# to the first move, not the search itself.
+STARTUP_SCRIPT = """
+import TeekoGame
+player = TeekoGame.TeekoPlayer()
+player.my_piece, player.opp = %r, %r
+player.depth_limit = 1
+print(player.make_move(%r), flush=True)
+"""
+
+# Metrics that improve as they grow; every other metric is better when smaller.
+HIGHER_IS_BETTER = {'search.nodes_per_sec'}
+
+
+def load_corpus(path=CORPUS_FILE):
+    """ Reads a position file.
+
+    Args:
+        path (str): file with one position per line, see benchmark_positions.txt
+
+    Returns:
+        dict: phase name -> list of (state, piece) pairs, where state is a list of
+            lists board and piece the colour to move
+    """
+    corpus = {phase: [] for phase in PHASES}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            piece, rows = line.split()
+            rows = rows.split('/')
+            if piece not in 'br' or len(rows) != 5 or any(len(row) != 5 for row in rows):
+                raise ValueError("%s:%d: malformed position %r" % (path, number, line))
+            state = [[' ' if cell == '.' else cell for cell in row] for row in rows]
+            count = sum(cell != ' ' for row in state for cell in row)
+            corpus['drop' if count < 8 else 'move'].append((state, piece))
+    return corpus
+
+
+def player_for(piece, depth):
+    """ A TeekoPlayer playing piece that always searches exactly depth plies, with
+    the opening book and tablebase turned off so that make_move times the search.
+    """
+    player = TeekoPlayer()
+    player.my_piece = piece
+    player.opp = 'r' if piece == 'b' else 'b'
+    player.book = player.tablebase = player.engine.tablebase = None
+    player.depth_limit = depth
+    player.time_limit = math.inf
+    return player
+
+
+def per_call(func, repeat=3):
+    """ Seconds per call of func, the best of repeat timeit runs """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def bench_search(positions, depth):
+    """ Runs iterative deepening to depth on every position with a fresh engine.
+
+    Returns:
+        tuple: (total nodes, total seconds)
+    """
+    nodes = seconds = 0
+    for state, piece in positions:
+        mine = bits_from_board(state, piece)
+        theirs = bits_from_board(state, 'r' if piece == 'b' else 'b')
+        engine = SearchEngine()
+        start = time.perf_counter()
+        engine.iterative_deepening(mine, theirs, math.inf, depth)
+        seconds += time.perf_counter() - start
+        nodes += engine.nodes
+    return nodes, seconds
+
+
+def bench_make_move(positions, depth):
+    """ Mean seconds per make_move call, each from a cleared engine """
+    seconds = 0
+    for state, piece in positions:
+        player = player_for(piece, depth)
+        start = time.perf_counter()
+        player.make_move(state)
+        seconds += time.perf_counter() - start
+    return seconds / len(positions)
+
+
+def bench_functions(positions, repeat=3):
+    """ Mean seconds per call of the TeekoPlayer evaluation functions """
+    players = {piece: player_for(piece, 1) for piece in 'br'}
+    calls = [(players[piece], state) for state, piece in positions]
+    results = {}
+    for name in ('succ', 'game_value', 'heuristic_game_value'):
+        bound = [(getattr(player, name), state) for player, state in calls]
+
+        def run():
+            for func, state in bound:
+                func(state)
+        results[name] = per_call(run, repeat) / len(bound)
+    return results
+
+
+def launch(code, runs=STARTUP_RUNS):
+    """ Median seconds from starting a new interpreter on code until it writes
+    its first line of output.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        child = subprocess.Popen([sys.executable, '-c', code], cwd=HERE, stdout=subprocess.PIPE)
+        child.stdout.readline()
+        times.append(time.perf_counter() - start)
+        child.communicate()
+        if child.returncode:
+            raise RuntimeError("startup benchmark exited with status %d" % child.returncode)
+    return sorted(times)[len(times) // 2]
+
+
+def bench_startup(corpus, runs=STARTUP_RUNS):
+    """ Cold-start latency of the first make_move, per phase.
+
+    Returns:
+        dict: metric name -> median seconds
+    """
+    metrics = {'startup.interpreter': launch('print(flush=True)', runs)}
+    for phase in PHASES:
+        if corpus[phase]:
+            state, piece = corpus[phase][0]
+            code = STARTUP_SCRIPT % (piece, 'r' if piece == 'b' else 'b', state)
+            metrics['startup.first_move.%s' % phase] = launch(code, runs)
+    return metrics
+
+
+def run(corpus, depth=5, repeat=3, log=None):
+    """ Runs every benchmark.
+
+    Args:
+        corpus (dict): positions by phase, from load_corpus
+        depth (int): search depth for the search and make_move benchmarks
+        repeat (int): timeit repetitions for the function benchmarks
+        log (callable): optional progress callback taking a message
+
+    Returns:
+        dict: metric name -> value; times are in seconds
+    """
+    metrics = {}
+    total_nodes = total_seconds = 0
+    for phase in PHASES:
+        positions = corpus[phase]
+        if not positions:
+            continue
+        nodes, seconds = bench_search(positions, depth)
+        total_nodes += nodes
+        total_seconds += seconds
+        metrics['search.time_to_depth_%d.%s' % (depth, phase)] = seconds
+        metrics['search.nodes_to_depth_%d.%s' % (depth, phase)] = nodes
+        metrics['make_move.%s' % phase] = bench_make_move(positions, depth)
+        for name, seconds in bench_functions(positions, repeat).items():
+            metrics['%s.%s' % (name, phase)] = seconds
+        if log:
+            log("%s phase done" % phase)
+    if total_seconds:
+        metrics['search.nodes_per_sec'] = total_nodes / total_seconds
+    metrics.update(bench_startup(corpus))
+    return metrics
+
+
+def compare(metrics, baseline, thresholds, default=DEFAULT_THRESHOLD):
+    """ Compares results with a baseline.
+
+    Args:
+        metrics (dict): current results
+        baseline (dict): baseline results
+        thresholds (dict): metric name -> allowed fraction of slowdown
+        default (float): threshold for metrics missing from thresholds
+
+    Returns:
+        list: (name, baseline value, value, change, regressed) for every metric
+            in both; change is the fraction by which the metric got worse
+            (negative when it improved)
+    """
+    rows = []
+    for name in sorted(metrics):
+        if name not in baseline or not baseline[name]:
+            continue
+        old, new = baseline[name], metrics[name]
+        change = (new - old) / old
+        if name in HIGHER_IS_BETTER:
+            change = -change
+        rows.append((name, old, new, change, change > thresholds.get(name, default)))
+    return rows
+
+
+def format_value(name, value):
+    if name.startswith('search.nodes'):
+        return "%d" % value
+    if value < 1e-3:
+        return "%.2f us" % (value * 1e6)
+    if value < 1:
+        return "%.2f ms" % (value * 1e3)
+    return "%.2f s" % value
+
+
+def parse_thresholds(items):
+    thresholds = {}
+    for item in items:
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError("expected NAME=FRACTION, got %r" % item)
+        thresholds[name] = float(value)
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=CORPUS_FILE)
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="write the results to --baseline instead of comparing")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--metric-threshold', action='append', default=[], metavar='NAME=FRACTION')
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--startup-only', action='store_true', help="only run the startup benchmark")
+    args = parser.parse_args(argv)
+
+    if args.startup_only:
+        metrics = bench_startup(load_corpus(args.corpus))
+    else:
+        metrics = run(load_corpus(args.corpus), args.depth, args.repeat,
+                      log=lambda msg: print(msg, file=sys.stderr))
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'depth': args.depth, 'metrics': metrics}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                report['thresholds'] = json.load(f).get('thresholds', {})
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("wrote baseline to %s" % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if baseline is None:
+        for name in sorted(metrics):
+            print("%-36s %12s" % (name, format_value(name, metrics[name])))
+        return 0
+    if baseline.get('depth') != args.depth:
+        print("baseline was recorded at depth %s, not %d; search metrics will not match"
+              % (baseline.get('depth'), args.depth), file=sys.stderr)
+    thresholds = dict(baseline.get('thresholds', {}))
+    thresholds.update(parse_thresholds(args.metric_threshold))
+    regressions = 0
+    for name, old, new, change, regressed in compare(metrics, baseline['metrics'], thresholds,
+                                                     args.threshold):
+        regressions += regressed
+        print("%-36s %12s %12s %+7.1f%%%s" % (name, format_value(name, old), format_value(name, new),
+                                              100 * change, "  REGRESSION" if regressed else ""))
+    if regressions:
+        print("%d metric(s) regressed" % regressions)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+""" Offline builder for the drop-phase opening book read by TeekoGame.OpeningBook.
+
+Starting from the empty board, the builder searches every position in which the
+book side is to move and records the best reply. It then follows that reply
+together with every possible answer from the opponent to find the next book
+positions. Positions are canonicalised first, so each symmetry class is searched
+and stored once. This is done once with black as the book side and once with red,
+so the book covers whichever colour TeekoPlayer is given.
+
+Usage:
+    python TeekoBook.py [--output teeko_book.bin] [--plies 6] [--depth 7]
+
+--plies limits the book to positions with fewer than that many pieces on the
+board. The default of 6 gives each side its first three drops.
+"""
+import argparse
+import os
+import sys
+import time
+
+from TeekoGame import (BOOK_FILE, NUM_CELLS, OpeningBook, SearchEngine, bb_apply, bb_moves,
+                       bb_wins_at, book_entry, canonical)
+
+
+def book_positions(plies):
+    """ Yields the roots of the two book trees: the empty board (black to move)
+    and every board after black's first drop (red to move), as canonical
+    (mover, other) pairs.
+    """
+    yield 0, 0
+    if plies > 1:
+        for cell in range(NUM_CELLS):
+            yield canonical(0, 1 << cell)[:2]
+
+
+def build(plies=6, depth=7, log=None):
+    """ Searches every book position.
+
+    Args:
+        plies (int): only positions with fewer pieces than this are booked
+        depth (int): search depth per position
+        log (callable): optional progress callback taking a message
+
+    Returns:
+        OpeningBook: the book
+    """
+    engine = SearchEngine(tt_size_mb=64)
+    replies = {}
+    frontier = set(book_positions(plies))
+    while frontier:
+        start = time.time()
+        next_frontier = set()
+        for mine, theirs in sorted(frontier):
+            if (mine, theirs) in replies:
+                continue
+            value, (src, dst) = engine.search(mine, theirs, depth)
+            replies[mine, theirs] = (src, dst)
+            child = bb_apply(mine, src, dst)
+            if bb_wins_at(child, dst) or (child | theirs).bit_count() + 1 >= plies:
+                continue
+            for opp_src, opp_dst in bb_moves(theirs, child):
+                reply = bb_apply(theirs, opp_src, opp_dst)
+                if not bb_wins_at(reply, opp_dst):
+                    next_frontier.add(canonical(child, reply)[:2])
+        if log is not None:
+            log("%d positions searched in %.1fs" % (len(frontier), time.time() - start))
+        frontier = next_frontier
+    return OpeningBook([book_entry(mine, theirs, src, dst)
+                        for (mine, theirs), (src, dst) in replies.items()])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         BOOK_FILE))
+    parser.add_argument('--plies', type=int, default=6)
+    parser.add_argument('--depth', type=int, default=7)
+    args = parser.parse_args(argv)
+    book = build(args.plies, args.depth, log=lambda msg: print(msg, file=sys.stderr))
+    book.save(args.output)
+    print("wrote %d positions to %s" % (len(book), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,1812 @@
 
+import bisect
+import itertools
+import marshal
 import random
 import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import namedtuple
+from functools import cached_property
+
+############################################################################
+#
+# PRECOMPUTED TABLES
+#
+############################################################################
+# The lookup tables in this module are not built lazily: the search reads them as
+# plain module globals in its innermost loops, where a first-use check would cost
+# on every call. Instead they are made at import, where building them all costs
+# about a millisecond of pure Python. TeekoSnapshot.py can save them
+# to TABLES_FILE next to this module; when that file exists and was written from
+# this exact source file and Python version, the tables are loaded from it with
+# marshal instead. Anything else (no file, a stale or corrupt one) falls back to
+# building them.
+TABLES_FILE = 'teeko_tables.bin'
+_TABLES_HEADER = struct.Struct('<4sII')
+_TABLES_MAGIC = b'TKPT'
+
+
+def _tables_fingerprint():
+    """ CRC-32 of this source file, which a snapshot must have been taken from """
+    with open(__file__, 'rb') as f:
+        return zlib.crc32(f.read())
+
+
+def _load_tables(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, fingerprint, version = _TABLES_HEADER.unpack_from(data, 0)
+        if magic == _TABLES_MAGIC and version == sys.hexversion and fingerprint == _tables_fingerprint():
+            return marshal.loads(data[_TABLES_HEADER.size:])
+    except (OSError, struct.error, EOFError, ValueError, TypeError):
+        pass
+    return {}
+
+
+_snapshot = _load_tables(os.path.join(os.path.dirname(os.path.abspath(__file__)), TABLES_FILE))
+_tables = {}
+
+
+def _table(name, build):
+    """ The table called name, from the snapshot if there is one, else build() """
+    value = _tables[name] = _snapshot[name] if name in _snapshot else build()
+    return value
+
+
+def save_tables(path=None):
+    """ Writes every table made through _table() to path (default: TABLES_FILE
+    next to this module), to be loaded by the next import.
+
+    Returns:
+        int: number of tables written
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TABLES_FILE)
+    with open(path, 'wb') as f:
+        f.write(_TABLES_HEADER.pack(_TABLES_MAGIC, _tables_fingerprint(), sys.hexversion))
+        f.write(marshal.dumps(_tables))
+    return len(_tables)
+
+
+############################################################################
+#
+# BITBOARD ENGINE
+#
+# A position is stored as one 25-bit integer per colour, where cell
+# (row, col) maps to bit row * 5 + col. The search works exclusively on
+# these integers; the list-of-lists boards used by TeekoPlayer's public
+# methods are converted at the boundary.
+#
+############################################################################
+BOARD_SIZE = 5
+NUM_CELLS = BOARD_SIZE * BOARD_SIZE
+FULL_BOARD = (1 << NUM_CELLS) - 1
+PIECES_PER_SIDE = 4
+
+
+def _mask(cells):
+    """ Builds a bitboard from an iterable of (row, col) tuples """
+    bits = 0
+    for row, col in cells:
+        bits |= 1 << (row * BOARD_SIZE + col)
+    return bits
+
+
+def _build_win_masks():
+    """ Enumerates the 44 winning patterns: 10 horizontal, 10 vertical, 4 diagonal
+    in each direction and 16 2x2 boxes.
+    """
+    masks = []
+    for row in range(5):
+        for col in range(2):
+            masks.append(_mask((row, col + k) for k in range(4)))
+    for col in range(5):
+        for row in range(2):
+            masks.append(_mask((row + k, col) for k in range(4)))
+    for row in range(2):
+        for col in range(2):
+            masks.append(_mask((row + k, col + k) for k in range(4)))
+    for row in range(2):
+        for col in range(3, 5):
+            masks.append(_mask((row + k, col - k) for k in range(4)))
+    for row in range(4):
+        for col in range(4):
+            masks.append(_mask([(row, col), (row, col + 1), (row + 1, col), (row + 1, col + 1)]))
+    return tuple(masks)
+
+
+def _build_adjacency():
+    """ For every cell, the bitboard of its (up to 8) neighbouring cells """
+    adjacent = []
+    for row in range(5):
+        for col in range(5):
+            adjacent.append(_mask(
+                (row + dr, col + dc)
+                for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+                if (dr or dc) and 0 <= row + dr < 5 and 0 <= col + dc < 5))
+    return tuple(adjacent)
+
+
+WIN_MASKS = _table('WIN_MASKS', _build_win_masks)
+ADJACENT = _table('ADJACENT', _build_adjacency)
+# The win masks that contain each cell; after a piece lands on a cell only these
+# can have been completed.
+CELL_WIN_MASKS = _table('CELL_WIN_MASKS', lambda: tuple(tuple(m for m in WIN_MASKS if m >> i & 1)
+                                                          for i in range(NUM_CELLS)))
+
+
+def bits_from_board(state, piece):
+    """ Converts one colour of a list-of-lists board into a bitboard.
+
+    Args:
+        state (list of lists): the board
+        piece (str): the colour to extract ('b' or 'r')
+
+    Returns:
+        int: bitboard with a bit set for every cell holding piece
+    """
+    bits = 0
+    for row in range(5):
+        line = state[row]
+        for col in range(5):
+            if line[col] == piece:
+                bits |= 1 << (row * BOARD_SIZE + col)
+    return bits
+
+
+def board_from_bits(black, red):
+    """ Converts a pair of bitboards back into a list-of-lists board.
+
+    Args:
+        black (int): bitboard of the 'b' pieces
+        red (int): bitboard of the 'r' pieces
+
+    Returns:
+        list of lists: a freshly allocated 5x5 board
+    """
+    board = [[' ' for j in range(5)] for i in range(5)]
+    for i in iter_bits(black):
+        board[i // BOARD_SIZE][i % BOARD_SIZE] = 'b'
+    for i in iter_bits(red):
+        board[i // BOARD_SIZE][i % BOARD_SIZE] = 'r'
+    return board
+
+
+def iter_bits(bits):
+    """ Yields the index of every set bit, lowest first """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def bb_is_win(bits):
+    """ Returns True if the bitboard completes any of the 44 winning patterns """
+    for mask in WIN_MASKS:
+        if bits & mask == mask:
+            return True
+    return False
+
+
+def bb_wins_at(bits, cell):
+    """ Returns True if a winning pattern through cell is complete. Cheaper than
+    bb_is_win when only the piece on cell can have changed the result.
+    """
+    for mask in CELL_WIN_MASKS[cell]:
+        if bits & mask == mask:
+            return True
+    return False
+
+
+def bb_moves(mine, theirs):
+    """ Generates the legal moves of the side owning mine.
+
+    Args:
+        mine (int): bitboard of the side to move
+        theirs (int): bitboard of the other side
+
+    Returns:
+        list: (src, dst) cell index pairs; src is None for drops
+    """
+    empty = FULL_BOARD & ~(mine | theirs)
+    if mine.bit_count() < PIECES_PER_SIDE:
+        return [(None, dst) for dst in iter_bits(empty)]
+    moves = []
+    for src in iter_bits(mine):
+        for dst in iter_bits(ADJACENT[src] & empty):
+            moves.append((src, dst))
+    return moves
+
+
+def bb_apply(mine, src, dst):
+    """ Returns the bitboard of the moving side after playing (src, dst) """
+    if src is None:
+        return mine | 1 << dst
+    return mine ^ (1 << src | 1 << dst)
+
+
+def bb_heuristic(mine, theirs):
+    """ Bitboard form of TeekoPlayer.heuristic_game_value: the largest number of
+    pieces either side has inside a single winning pattern, scaled to [-1, 1].
+    """
+    my_score = 0
+    opp_score = 0
+    for mask in WIN_MASKS:
+        count = (mine & mask).bit_count()
+        if count > my_score:
+            my_score = count
+        count = (theirs & mask).bit_count()
+        if count > opp_score:
+            opp_score = count
+    return my_score / 4 if my_score >= opp_score else opp_score / -4
+
+
+def move_from_indices(src, dst):
+    """ Converts a (src, dst) cell index pair into the [(row, col), (source_row,
+    source_col)] move format used by TeekoPlayer.
+    """
+    move = [divmod(dst, BOARD_SIZE)]
+    if src is not None:
+        move.append(divmod(src, BOARD_SIZE))
+    return move
+
+
+class Move(namedtuple('Move', ['src', 'dst'])):
+    """ A move as a pair of cell indices (row * 5 + col). src is None for a drop.
+
+    Being a tuple, a Move compares equal to the plain (src, dst) pairs the search
+    uses internally.
+    """
+    __slots__ = ()
+
+    def to_list(self):
+        """ The [(row, col), (source_row, source_col)] form used by TeekoPlayer """
+        return move_from_indices(self.src, self.dst)
+
+    @classmethod
+    def from_list(cls, move):
+        """ Inverse of to_list
+
+        Raises:
+            ValueError: unless move is a list of one or two (row, col) pairs of
+                ints on the board
+        """
+        if not isinstance(move, (list, tuple)) or not 1 <= len(move) <= 2:
+            raise ValueError("Illegal move: expected [(row, col)] or [(row, col), (source_row, source_col)]")
+        cells = []
+        for cell in move:
+            if not (isinstance(cell, (list, tuple)) and len(cell) == 2 and all(type(x) is int for x in cell)):
+                raise ValueError("Illegal move: %r is not a (row, col) pair" % (cell,))
+            if not (0 <= cell[0] < BOARD_SIZE and 0 <= cell[1] < BOARD_SIZE):
+                raise ValueError("Illegal move: off the board")
+            cells.append(cell[0] * BOARD_SIZE + cell[1])
+        return cls(cells[1] if len(cells) > 1 else None, cells[0])
+
+
+def other_piece(piece):
+    """ The opposing colour of 'b' or 'r' """
+    return 'r' if piece == 'b' else 'b'
+
+
+def generate_moves(state, side):
+    """ Generates the legal moves of side without copying the board. Whether side
+    drops or moves a piece depends only on how many pieces side already has.
+
+    Args:
+        state (list of lists): the board
+        side (str): the colour to move, 'b' or 'r'
+
+    Returns:
+        list: the Move objects of side
+    """
+    mine = bits_from_board(state, side)
+    theirs = bits_from_board(state, other_piece(side))
+    return [Move(src, dst) for src, dst in bb_moves(mine, theirs)]
+
+
+def apply_move(state, move, piece):
+    """ Returns a copy of state with move played for piece """
+    new_state = [row.copy() for row in state]
+    if move[0] is not None:
+        new_state[move[0] // BOARD_SIZE][move[0] % BOARD_SIZE] = ' '  # Remove piece from old location
+    new_state[move[1] // BOARD_SIZE][move[1] % BOARD_SIZE] = piece  # Place piece in new location
+    return new_state
+
+
+############################################################################
+#
+# SYMMETRY
+#
+# The board has the 8 symmetries of the square. Transform t rotates the board
+# t % 4 quarter turns clockwise and then, for t >= 4, mirrors it left to right;
+# transform 0 is the identity. Winning patterns and adjacency are invariant
+# under all of them, so symmetric positions have the same value and their best
+# moves map onto each other.
+#
+############################################################################
+NUM_SYMMETRIES = 8
+
+
+def _build_symmetry_maps():
+    maps = []
+    for t in range(NUM_SYMMETRIES):
+        cells = []
+        for cell in range(NUM_CELLS):
+            row, col = divmod(cell, BOARD_SIZE)
+            for _ in range(t % 4):
+                row, col = col, BOARD_SIZE - 1 - row
+            if t >= 4:
+                col = BOARD_SIZE - 1 - col
+            cells.append(row * BOARD_SIZE + col)
+        maps.append(tuple(cells))
+    return tuple(maps)
+
+
+# SYMMETRY_MAPS[t][cell] is the image of cell under transform t.
+SYMMETRY_MAPS = _table('SYMMETRY_MAPS', _build_symmetry_maps)
+# INVERSE_SYMMETRY[t] undoes transform t.
+INVERSE_SYMMETRY = _table('INVERSE_SYMMETRY', lambda: tuple(
+    next(u for u in range(NUM_SYMMETRIES)
+         if all(SYMMETRY_MAPS[u][SYMMETRY_MAPS[t][cell]] == cell for cell in range(NUM_CELLS)))
+    for t in range(NUM_SYMMETRIES)))
+
+
+def _build_row_images():
+    tables = []
+    for t in range(NUM_SYMMETRIES):
+        rows = []
+        for row in range(BOARD_SIZE):
+            # each pattern is a smaller pattern (itself without its lowest bit)
+            # plus the image of that one cell
+            images = [0]
+            for pattern in range(1, 1 << BOARD_SIZE):
+                low = pattern & -pattern
+                images.append(images[pattern ^ low]
+                              | 1 << SYMMETRY_MAPS[t][row * BOARD_SIZE + low.bit_length() - 1])
+            rows.append(tuple(images))
+        tables.append(tuple(rows))
+    return tuple(tables)
+
+
+# A bitboard is transformed one row (5 bits) at a time: _ROW_IMAGES[t][row][bits]
+# is the image of that row pattern.
+_ROW_IMAGES = _table('_ROW_IMAGES', _build_row_images)
+
+
+def bb_transform(bits, t):
+    """ Applies symmetry t to a bitboard """
+    rows = _ROW_IMAGES[t]
+    return (rows[0][bits & 31] | rows[1][bits >> 5 & 31] | rows[2][bits >> 10 & 31]
+            | rows[3][bits >> 15 & 31] | rows[4][bits >> 20 & 31])
+
+
+def transform_move(src, dst, t):
+    """ Applies symmetry t to a (src, dst) move; src may be None """
+    cells = SYMMETRY_MAPS[t]
+    return (None if src is None else cells[src]), cells[dst]
+
+
+def transform_board(state, t):
+    """ Applies symmetry t to a list-of-lists board, returning a new board """
+    board = [[' ' for j in range(5)] for i in range(5)]
+    cells = SYMMETRY_MAPS[t]
+    for cell in range(NUM_CELLS):
+        row, col = divmod(cells[cell], BOARD_SIZE)
+        board[row][col] = state[cell // BOARD_SIZE][cell % BOARD_SIZE]
+    return board
+
+
+def canonical(mine, theirs):
+    """ Maps a position to the representative of its symmetry class: the image
+    with the smallest (mine << 25 | theirs).
+
+    Args:
+        mine (int): bitboard of the side to move
+        theirs (int): bitboard of the other side
+
+    Returns:
+        tuple: (canonical_mine, canonical_theirs, t) where t is the transform that
+            was applied; map moves found in the canonical position back with
+            transform_move(src, dst, INVERSE_SYMMETRY[t])
+    """
+    best = mine << NUM_CELLS | theirs
+    best_t = 0
+    for t in range(1, NUM_SYMMETRIES):
+        image = bb_transform(mine, t) << NUM_CELLS | bb_transform(theirs, t)
+        if image < best:
+            best, best_t = image, t
+    return best >> NUM_CELLS, best & FULL_BOARD, best_t
+
+
+def canonical_key(mine, theirs):
+    """ A single integer identifying the symmetry class of a position, for use as
+    a cache or book key.
+    """
+    mine, theirs, _ = canonical(mine, theirs)
+    return mine << NUM_CELLS | theirs
+
+
+def stabilizer(mine, theirs):
+    """ Returns the transforms that leave the position unchanged (always includes 0) """
+    return [t for t in range(NUM_SYMMETRIES)
+            if bb_transform(mine, t) == mine and bb_transform(theirs, t) == theirs]
+
+
+def unique_moves(mine, theirs, moves):
+    """ Drops moves that lead to a position symmetric to one reached by an earlier
+    kept move. Only positions that are themselves symmetric (mostly the empty or
+    nearly empty board) lose anything.
+
+    Args:
+        mine (int): bitboard of the side to move
+        theirs (int): bitboard of the other side
+        moves (list): (src, dst) moves of the side to move
+
+    Returns:
+        list: one move from every class of equivalent moves, in the original order
+    """
+    symmetries = stabilizer(mine, theirs)
+    if len(symmetries) == 1:
+        return moves
+    kept, seen = [], set()
+    for src, dst in moves:
+        if (src, dst) in seen:
+            continue
+        kept.append((src, dst))
+        for t in symmetries:
+            seen.add(transform_move(src, dst, t))
+    return kept
+
+
+############################################################################
+#
+# ALPHA-BETA SEARCH
+#
+############################################################################
+# Scores are from the point of view of the side to move. A win found at ply p
+# scores WIN_SCORE - p so that faster wins (and slower losses) are preferred;
+# heuristic leaves always lie within [-1, 1].
+WIN_SCORE = 1000
+MAX_PLY = 64
+# How far past the horizon the search keeps following threats: while the side
+# to move faces a pattern the opponent can complete, only blocks are searched,
+# for up to this many extra plies.
+THREAT_PLIES = 4
+
+# The evaluation order used by heuristic_game_value: centre first, corners last.
+CENTRE_FIRST = [
+    (2, 2),  # Center
+    (2, 1), (2, 3), (1, 2), (3, 2),  # Immediate neighbors of the center
+    (1, 1), (1, 3), (3, 1), (3, 3),  # Diagonals around the center
+    (0, 2), (4, 2), (2, 0), (2, 4),  # Vertical and horizontal lines from the center
+    (0, 1), (0, 3), (1, 0), (1, 4), (3, 0), (3, 4), (4, 1), (4, 3),  # Outer neighbors
+    (0, 0), (0, 4), (4, 0), (4, 4)   # Corners
+]
+# Static ordering bonus per destination cell, highest for the centre.
+CENTRE_BONUS = [0] * NUM_CELLS
+for _rank, (_row, _col) in enumerate(CENTRE_FIRST):
+    CENTRE_BONUS[_row * BOARD_SIZE + _col] = NUM_CELLS - _rank
+del _rank, _row, _col
+
+
+def move_key(src, dst):
+    """ Packs a (src, dst) pair into a small integer; drops use src index 25 """
+    return (NUM_CELLS if src is None else src) * NUM_CELLS + dst
+
+
+NUM_MOVE_KEYS = (NUM_CELLS + 1) * NUM_CELLS
+
+
+def unpack_move_key(key):
+    """ Inverse of move_key """
+    src, dst = divmod(key, NUM_CELLS)
+    return (None if src == NUM_CELLS else src), dst
+
+
+############################################################################
+#
+# ZOBRIST HASHING AND TRANSPOSITION TABLE
+#
+############################################################################
+# Keys are relative to the side to move: a position hashes as
+#     ZOBRIST_MOVER[mover's cells] ^ ZOBRIST_OTHER[other cells] (^ ZOBRIST_SIDE)
+# where ZOBRIST_SIDE is present when the mover is not the player the search was
+# started for (the evaluation favours that player on ties). Alongside each key the
+# search carries the "swapped" key, with the two tables exchanged, which makes the
+# child key a single XOR away:
+#     child_key = swapped_key ^ ZOBRIST_OTHER_DELTA[move]
+#     child_swapped = key ^ ZOBRIST_MOVER_DELTA[move]
+def _build_zobrist():
+    rng = random.Random(0x7EE60)
+    mover = tuple(rng.getrandbits(64) for _ in range(NUM_CELLS))
+    other = tuple(rng.getrandbits(64) for _ in range(NUM_CELLS))
+    return mover, other, rng.getrandbits(64)
+
+
+ZOBRIST_MOVER, ZOBRIST_OTHER, ZOBRIST_SIDE = _table('ZOBRIST', _build_zobrist)
+
+
+def _zobrist_deltas(table):
+    deltas = []
+    for key in range(NUM_MOVE_KEYS):
+        src, dst = unpack_move_key(key)
+        delta = table[dst] ^ ZOBRIST_SIDE
+        if src is not None:
+            delta ^= table[src]
+        deltas.append(delta)
+    return tuple(deltas)
+
+
+ZOBRIST_MOVER_DELTA = _table('ZOBRIST_MOVER_DELTA', lambda: _zobrist_deltas(ZOBRIST_MOVER))
+ZOBRIST_OTHER_DELTA = _table('ZOBRIST_OTHER_DELTA', lambda: _zobrist_deltas(ZOBRIST_OTHER))
+
+
+def zobrist_keys(mine, theirs):
+    """ Computes the hash of a position from scratch.
+
+    Args:
+        mine (int): bitboard of the side to move
+        theirs (int): bitboard of the other side
+
+    Returns:
+        tuple: (key, swapped_key) as used by SearchEngine
+    """
+    key = swapped = 0
+    for i in iter_bits(mine):
+        key ^= ZOBRIST_MOVER[i]
+        swapped ^= ZOBRIST_OTHER[i]
+    for i in iter_bits(theirs):
+        key ^= ZOBRIST_OTHER[i]
+        swapped ^= ZOBRIST_MOVER[i]
+    return key, swapped
+
+
+# Transposition table bound types.
+EXACT, LOWER, UPPER = 1, 2, 3
+NO_MOVE = NUM_MOVE_KEYS
+_OCCUPIED = 1 << 48
+
+
+class TranspositionTable:
+    """ Fixed-size hash table of search results.
+
+    Entries live in two arrays of 64-bit words (key, packed data) so the table
+    costs exactly 16 bytes per entry regardless of what is stored. Each bucket
+    holds two entries: a depth-preferred slot that is only replaced by a search
+    at least as deep, and an always-replace slot for everything else.
+
+    The arrays are views of anonymous memory maps, whose pages the OS zeroes on
+    first touch. A new or cleared table therefore costs nothing up front, and a
+    short search only pays for the pages it uses.
+
+    Attributes:
+        hits (int): probes that found the position
+        misses (int): probes that did not
+        collisions (int): misses where the bucket held other positions
+    """
+
+    ENTRY_BYTES = 16
+
+    def __init__(self, size_mb=16):
+        """ Allocates a table using at most size_mb megabytes.
+
+        Args:
+            size_mb (float): memory budget; rounded down to a power-of-two number
+                of buckets, with a minimum of one bucket
+        """
+        buckets = max(1, int(size_mb * 1024 * 1024) // (2 * self.ENTRY_BYTES))
+        buckets = 1 << (buckets.bit_length() - 1)
+        self.mask = buckets - 1
+        self.keys = self._zeros(2 * buckets)
+        self.data = self._zeros(2 * buckets)
+        self.hits = self.misses = self.collisions = 0
+
+    @staticmethod
+    def _zeros(count):
+        return memoryview(mmap.mmap(-1, 8 * count)).cast('Q')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clear(self):
+        """ Empties the table and resets the counters """
+        self.keys = self._zeros(len(self.keys))
+        self.data = self._zeros(len(self.data))
+        self.hits = self.misses = self.collisions = 0
+
+    def probe(self, key):
+        """ Looks up a position.
+
+        Args:
+            key (int): the position's Zobrist key
+
+        Returns:
+            tuple: (value, depth, bound, move_key) or None; value is in quarter
+                units as passed to store()
+        """
+        slot = (key & self.mask) << 1
+        keys = self.keys
+        if keys[slot] != key:
+            slot += 1
+            if keys[slot] != key:
+                self.misses += 1
+                if self.data[slot] or self.data[slot - 1]:
+                    self.collisions += 1
+                return None
+        data = self.data[slot]
+        if not data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ((data >> 32 & 0xFFFF) - 0x8000, data >> 24 & 0xFF, data >> 16 & 0xFF, data & 0xFFFF)
+
+    def store(self, key, value, depth, bound, move):
+        """ Records a search result.
+
+        Args:
+            key (int): the position's Zobrist key
+            value (int): score in quarter units, within 16 signed bits
+            depth (int): remaining depth the score was searched to
+            bound (int): EXACT, LOWER or UPPER
+            move (int): move_key of the best move, or NO_MOVE
+        """
+        slot = (key & self.mask) << 1
+        data = _OCCUPIED | (value + 0x8000) << 32 | depth << 24 | bound << 16 | move
+        if self.keys[slot] == key or depth >= (self.data[slot] >> 24 & 0xFF):
+            self.keys[slot] = key
+            self.data[slot] = data
+        else:
+            self.keys[slot + 1] = key
+            self.data[slot + 1] = data
+
+
+def _to_tt(value, ply):
+    """ Converts a search score into quarter units relative to the node, so that a
+    win stored at one ply reads back correctly at another.
+    """
+    if value > WIN_SCORE // 2:
+        value += ply
+    elif value < -WIN_SCORE // 2:
+        value -= ply
+    return round(value * 4)
+
+
+def _from_tt(value, ply):
+    value /= 4
+    if value > WIN_SCORE // 2:
+        value -= ply
+    elif value < -WIN_SCORE // 2:
+        value += ply
+    return value
+
+
+############################################################################
+#
+# ENDGAME TABLEBASE
+#
+############################################################################
+# Once all eight pieces are down a position is fully described by the set of
+# four cells held by the side to move and the four cells held by the other side,
+# so it can be ranked combinatorially: the mover's set is ranked among the 25
+# cells and the other set among the 21 cells left over. That gives
+# C(25,4) * C(21,4) = 75,710,250 indices with no gaps and no hashing. The table is
+# built offline by TeekoTablebase.py.
+#
+# Each position is one byte: 0 means a draw in a complete table (or "not solved"
+# in a partial one), otherwise the byte is distance + 1, where distance is the
+# number of plies until the winning move is made. Odd distances are wins for the
+# side to move and even distances losses.
+TABLEBASE_FILE = 'teeko_tablebase.bin'
+_BINOMIAL = [[math.comb(n, k) for k in range(PIECES_PER_SIDE + 1)] for n in range(NUM_CELLS + 1)]
+TABLEBASE_OTHER_SETS = math.comb(NUM_CELLS - PIECES_PER_SIDE, PIECES_PER_SIDE)
+TABLEBASE_SIZE = math.comb(NUM_CELLS, PIECES_PER_SIDE) * TABLEBASE_OTHER_SETS
+
+# Result of a tablebase probe, from the point of view of the side to move.
+TB_WIN, TB_DRAW, TB_LOSS = 1, 0, -1
+
+
+def tablebase_index(mine, theirs):
+    """ Ranks a move-phase position.
+
+    Args:
+        mine (int): bitboard of the side to move (four pieces)
+        theirs (int): bitboard of the other side (four pieces)
+
+    Returns:
+        int: index in [0, TABLEBASE_SIZE)
+    """
+    mover_rank = other_rank = 0
+    k = 1
+    for cell in iter_bits(mine):
+        mover_rank += _BINOMIAL[cell][k]
+        k += 1
+    k = 1
+    for cell in iter_bits(theirs):
+        # position of cell among the 21 cells not taken by the mover
+        other_rank += _BINOMIAL[cell - (mine & ((1 << cell) - 1)).bit_count()][k]
+        k += 1
+    return mover_rank * TABLEBASE_OTHER_SETS + other_rank
+
+
+def tablebase_position(index):
+    """ Inverse of tablebase_index.
+
+    Returns:
+        tuple: (mine, theirs) bitboards
+    """
+    mover_rank, other_rank = divmod(index, TABLEBASE_OTHER_SETS)
+    mine = _unrank_set(mover_rank, NUM_CELLS)
+    free = [cell for cell in range(NUM_CELLS) if not mine >> cell & 1]
+    theirs = 0
+    for slot in iter_bits(_unrank_set(other_rank, len(free))):
+        theirs |= 1 << free[slot]
+    return mine, theirs
+
+
+def _unrank_set(rank, n):
+    bits = 0
+    for k in range(PIECES_PER_SIDE, 0, -1):
+        n -= 1
+        while _BINOMIAL[n][k] > rank:
+            n -= 1
+        rank -= _BINOMIAL[n][k]
+        bits |= 1 << n
+    return bits
+
+
+class Tablebase:
+    """ Read-only, memory-mapped view of a tablebase file.
+
+    Nothing is read at open time beyond the header; every probe is a single
+    byte lookup in the mapped file.
+
+    Attributes:
+        complete (bool): whether every position was solved; in a partial table
+            positions further than max_distance from the end read as unknown
+        max_distance (int): longest distance stored in the table
+    """
+
+    HEADER = struct.Struct('<4sHHII')
+    MAGIC = b'TKTB'
+    VERSION = 1
+    FLAG_COMPLETE = 1
+
+    def __init__(self, path):
+        """ Maps the tablebase at path; raises ValueError if it is not one """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, max_distance, size = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or version != self.VERSION or size != TABLEBASE_SIZE \
+                or len(self._mm) != self.HEADER.size + size:
+            self._mm.close()
+            raise ValueError(path + " is not a Teeko tablebase")
+        self.complete = bool(flags & self.FLAG_COMPLETE)
+        self.max_distance = max_distance
+
+    @classmethod
+    def open(cls, path=None):
+        """ Opens the tablebase at path (default: TABLEBASE_FILE next to this
+        module), returning None if there is no file there.
+        """
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TABLEBASE_FILE)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def close(self):
+        self._mm.close()
+
+    def probe(self, mine, theirs):
+        """ Looks up a move-phase position.
+
+        Args:
+            mine (int): bitboard of the side to move
+            theirs (int): bitboard of the other side
+
+        Returns:
+            tuple: (result, distance) with result TB_WIN, TB_DRAW or TB_LOSS for the
+                side to move, or None if the position is not solved in this table
+        """
+        byte = self._mm[self.HEADER.size + tablebase_index(mine, theirs)]
+        if byte:
+            distance = byte - 1
+            return (TB_WIN if distance & 1 else TB_LOSS), distance
+        return (TB_DRAW, 0) if self.complete else None
+
+    def best_move(self, mine, theirs):
+        """ Picks a move from the table alone: the fastest win, otherwise the
+        drawing move with the best heuristic value, otherwise the slowest loss.
+
+        Returns:
+            tuple: (src, dst), or None if some move leads to an unsolved position
+                and no win was found
+        """
+        best_key, best = None, None
+        unknown = False
+        for src, dst in bb_moves(mine, theirs):
+            child = bb_apply(mine, src, dst)
+            if bb_wins_at(child, dst):
+                return src, dst
+            entry = self.probe(theirs, child)
+            if entry is None:
+                unknown = True
+                continue
+            result, distance = entry
+            if result == TB_LOSS:  # the opponent loses: we win
+                key = (2, -distance)
+            elif result == TB_DRAW:
+                key = (1, bb_heuristic(child, theirs))
+            else:
+                key = (0, distance)
+            if best_key is None or key > best_key:
+                best_key, best = key, (src, dst)
+        if best_key is None or (unknown and best_key[0] < 2):
+            return None
+        return best
+
+
+############################################################################
+#
+# OPENING BOOK
+#
+############################################################################
+# Best replies for drop-phase positions, computed offline by TeekoBook.py. Each
+# entry is a single 64-bit word
+#     canonical_key(mover, other) << 10 | move_key
+# with mover/other the bitboards of the side to move and the other side and the
+# move given in the canonical orientation, kept sorted so a lookup is a binary
+# search over the loaded array. Only one position per symmetry class is stored.
+BOOK_FILE = 'teeko_book.bin'
+_BOOK_MOVE_BITS = 10
+
+
+def book_entry(mine, theirs, src, dst):
+    """ Packs a book position and its reply into one integer, in canonical form """
+    mine, theirs, t = canonical(mine, theirs)
+    src, dst = transform_move(src, dst, t)
+    return (mine << NUM_CELLS | theirs) << _BOOK_MOVE_BITS | move_key(src, dst)
+
+
+class OpeningBook:
+    """ Drop-phase opening book loaded from a TeekoBook.py file.
+
+    Attributes:
+        entries (array): sorted book entries as produced by book_entry
+    """
+
+    HEADER = struct.Struct('<4sHHI')
+    MAGIC = b'TKOB'
+    VERSION = 2
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a book file; raises ValueError if it is not one """
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, flags, count = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION or len(data) != cls.HEADER.size + 8 * count:
+            raise ValueError(path + " is not a Teeko opening book")
+        entries = array('Q')
+        entries.frombytes(data[cls.HEADER.size:])
+        if sys.byteorder != 'little':
+            entries.byteswap()
+        return cls(entries)
+
+    @classmethod
+    def open(cls, path=None):
+        """ Loads the book at path (default: BOOK_FILE next to this module),
+        returning None if there is no file there.
+        """
+        if path is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), BOOK_FILE)
+        if not os.path.exists(path):
+            return None
+        return cls.load(path)
+
+    def save(self, path):
+        """ Writes the book to path in the format read by load() """
+        entries = array('Q', sorted(self.entries))
+        if sys.byteorder != 'little':
+            entries.byteswap()
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, len(entries)))
+            f.write(entries.tobytes())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, mine, theirs):
+        """ Finds the book reply for a position.
+
+        Args:
+            mine (int): bitboard of the side to move
+            theirs (int): bitboard of the other side
+
+        Returns:
+            tuple: (src, dst) of the book move, or None if the position is not in
+                the book
+        """
+        mine, theirs, t = canonical(mine, theirs)
+        position = mine << NUM_CELLS | theirs
+        i = bisect.bisect_left(self.entries, position << _BOOK_MOVE_BITS)
+        if i < len(self.entries) and self.entries[i] >> _BOOK_MOVE_BITS == position:
+            src, dst = unpack_move_key(self.entries[i] & ((1 << _BOOK_MOVE_BITS) - 1))
+            return transform_move(src, dst, INVERSE_SYMMETRY[t])
+        return None
+
+
+############################################################################
+#
+# INCREMENTAL EVALUATION
+#
+############################################################################
+# The search keeps, per colour, how many of its pieces sit inside each of the 44
+# winning patterns, packed into one integer with a 3-bit field per pattern
+# (pattern i in bits 3i..3i+2). Counts never leave 0..4, so playing a piece is a
+# single addition of LINE_INCREMENT[cell] (a 1 in the field of every pattern
+# through cell) and the field tests below need only a few masks.
+LINE_FIELD_BITS = 3
+_LINE_LOW = sum(1 << (LINE_FIELD_BITS * i) for i in range(len(WIN_MASKS)))
+_LINE_MID = _LINE_LOW << 1
+_LINE_HIGH = _LINE_LOW << 2
+LINE_INCREMENT = _table('LINE_INCREMENT', lambda: tuple(
+    sum(1 << (LINE_FIELD_BITS * i) for i, mask in enumerate(WIN_MASKS) if mask >> cell & 1)
+    for cell in range(NUM_CELLS)))
+
+
+def _line_delta(key):
+    src, dst = unpack_move_key(key)
+    return LINE_INCREMENT[dst] - (0 if src is None else LINE_INCREMENT[src])
+
+
+# Change to the mover's packed counts for every move_key.
+LINE_DELTA = _table('LINE_DELTA', lambda: tuple(_line_delta(key) for key in range(NUM_MOVE_KEYS)))
+
+
+def line_counts(bits):
+    """ Packs the number of pieces of bits inside every winning pattern """
+    counts = 0
+    for cell in iter_bits(bits):
+        counts += LINE_INCREMENT[cell]
+    return counts
+
+
+def best_line_count(counts):
+    """ The largest field of a packed count: the most pieces in any one pattern """
+    if counts & _LINE_HIGH:
+        return 4
+    if counts & (counts >> 1) & _LINE_LOW:
+        return 3
+    if counts & _LINE_MID:
+        return 2
+    return 1 if counts else 0
+
+
+class SearchBoard:
+    """ Mutable position that the search plays moves on and takes them back from.
+
+    Colour 0 is the player the search was started for and colour 1 the opponent.
+    Alongside the two bitboards the board keeps each colour's packed pattern
+    counts (see LINE_INCREMENT), so a move costs two integer additions and
+    heuristic_game_value's "most pieces in any one pattern" is read straight off
+    the counts instead of rescanning the 44 patterns.
+
+    Attributes:
+        bits (list): bitboard per colour
+        lines (list): packed pattern counts per colour
+        side (int): colour to move
+        key (int): Zobrist key of the position relative to the side to move
+        swapped (int): the same key with the two Zobrist tables exchanged
+    """
+
+    __slots__ = ('bits', 'lines', 'side', 'key', 'swapped')
+
+    def __init__(self, mine, theirs):
+        """
+        Args:
+            mine (int): bitboard of the side to move, which becomes colour 0
+            theirs (int): bitboard of the other side
+        """
+        self.bits = [mine, theirs]
+        self.lines = [line_counts(mine), line_counts(theirs)]
+        self.side = 0
+        self.key, self.swapped = zobrist_keys(mine, theirs)
+
+    def make(self, src, dst):
+        """ Plays (src, dst) for the side to move """
+        side = self.side
+        mk = move_key(src, dst)
+        if src is None:
+            self.bits[side] |= 1 << dst
+        else:
+            self.bits[side] ^= 1 << src | 1 << dst
+        self.lines[side] += LINE_DELTA[mk]
+        self.key, self.swapped = self.swapped ^ ZOBRIST_OTHER_DELTA[mk], self.key ^ ZOBRIST_MOVER_DELTA[mk]
+        self.side = side ^ 1
+
+    def unmake(self, src, dst):
+        """ Takes back (src, dst), which must be the last move made """
+        side = self.side ^ 1
+        self.side = side
+        mk = move_key(src, dst)
+        if src is None:
+            self.bits[side] ^= 1 << dst
+        else:
+            self.bits[side] ^= 1 << src | 1 << dst
+        self.lines[side] -= LINE_DELTA[mk]
+        self.key, self.swapped = self.swapped ^ ZOBRIST_MOVER_DELTA[mk], self.key ^ ZOBRIST_OTHER_DELTA[mk]
+
+    def has_won(self, colour):
+        """ Whether colour fills a winning pattern """
+        return bool(self.lines[colour] & _LINE_HIGH)
+
+    def evaluate(self):
+        """ heuristic_game_value for colour 0, without rescanning the board """
+        my_score = best_line_count(self.lines[0])
+        opp_score = best_line_count(self.lines[1])
+        return my_score / 4 if my_score >= opp_score else opp_score / -4
+
+    def winning_moves(self, colour):
+        """ The moves that would complete a pattern for colour if it were to move.
+        Only patterns holding three of colour's pieces, read off the packed
+        counts, are looked at, and a slide must come from outside the pattern.
+        """
+        counts = self.lines[colour]
+        three = counts & (counts >> 1) & _LINE_LOW & ~(counts >> 2)
+        if not three:
+            return []
+        bits = self.bits[colour]
+        empty = FULL_BOARD & ~(self.bits[0] | self.bits[1])
+        drop = bits.bit_count() < PIECES_PER_SIDE
+        moves = []
+        for field in iter_bits(three):
+            mask = WIN_MASKS[field // LINE_FIELD_BITS]
+            cell = mask & empty
+            if not cell:
+                continue
+            dst = cell.bit_length() - 1
+            if drop:
+                moves.append((None, dst))
+            else:
+                sources = bits & ADJACENT[dst] & ~mask
+                if sources:
+                    moves.append(((sources & -sources).bit_length() - 1, dst))
+        return moves
+
+    def winning_move(self):
+        """ A move that wins on the spot for the side to move, or None """
+        moves = self.winning_moves(self.side)
+        return moves[0] if moves else None
+
+    def threat_cells(self, colour):
+        """ The cells colour could actually win on with its next move """
+        cells = 0
+        for src, dst in self.winning_moves(colour):
+            cells |= 1 << dst
+        return cells
+
+    def threats(self, colour):
+        """ The empty cells that would complete a pattern for colour, whether or not
+        a piece can reach them
+        """
+        counts = self.lines[colour]
+        three = counts & (counts >> 1) & _LINE_LOW & ~(counts >> 2)
+        if not three:
+            return 0
+        empty = FULL_BOARD & ~(self.bits[0] | self.bits[1])
+        threats = 0
+        for bit in iter_bits(three):
+            threats |= WIN_MASKS[bit // LINE_FIELD_BITS] & empty
+        return threats
+
+
+class SearchStats:
+    """ What one search did, for tuning time budgets and spotting regressions.
+
+    A plain SearchEngine fills in the counters it keeps anyway (nodes, depth,
+    transposition table hits and misses, elapsed time). InstrumentedSearchEngine
+    also fills in the rest.
+
+    Attributes:
+        nodes (int): positions visited
+        leaf_evaluations (int): heuristic evaluations at the search horizon
+        cutoffs (int): beta cutoffs, not counting transposition table cutoffs
+        tt_hits (int): transposition table probes that found the position
+        tt_misses (int): probes that did not
+        depth_reached (int): deepest fully completed iteration
+        expanded (list): per ply, the number of nodes whose moves were generated
+        children (list): per ply, the number of moves those nodes had
+        time_generate (float): seconds spent generating moves (TeekoPlayer.succ)
+        time_win_check (float): seconds spent looking for winning moves
+            (TeekoPlayer.game_value)
+        time_evaluate (float): seconds spent in leaf evaluation
+            (TeekoPlayer.heuristic_game_value)
+        elapsed (float): wall-clock seconds for the whole search
+        value (float): score of the chosen move
+        move (tuple): the chosen (src, dst) move
+    """
+
+    __slots__ = ('nodes', 'leaf_evaluations', 'cutoffs', 'tt_hits', 'tt_misses', 'depth_reached',
+                 'expanded', 'children', 'time_generate', 'time_win_check', 'time_evaluate',
+                 'elapsed', 'value', 'move')
+
+    def __init__(self):
+        self.nodes = self.leaf_evaluations = self.cutoffs = 0
+        self.tt_hits = self.tt_misses = self.depth_reached = 0
+        self.expanded = [0] * MAX_PLY
+        self.children = [0] * MAX_PLY
+        self.time_generate = self.time_win_check = self.time_evaluate = 0.0
+        self.elapsed = 0.0
+        self.value = None
+        self.move = None
+
+    def branching_factor(self):
+        """ Average number of moves per expanded node, for every ply reached """
+        return [children / expanded for expanded, children in zip(self.expanded, self.children)
+                if expanded]
+
+    def as_dict(self):
+        """ The statistics as a dict, e.g. for structured logging """
+        stats = {name: getattr(self, name) for name in self.__slots__
+                 if name not in ('expanded', 'children')}
+        stats['branching_factor'] = self.branching_factor()
+        return stats
+
+    def __repr__(self):
+        return 'SearchStats(%s)' % ', '.join('%s=%r' % item for item in self.as_dict().items())
+
+
+class SearchTimeout(Exception):
+    """ Raised inside SearchEngine when the deadline of the current search passes """
+
+
+class SearchEngine:
+    """ Negamax alpha-beta search over bitboards, played out by make/unmake on a
+    single SearchBoard per search.
+
+    Moves are tried in the order: transposition table move, blocks of the
+    opponent's immediate wins, killer moves, history heuristic, and finally the
+    centre-first order of CENTRE_FIRST. Immediate wins are detected before any
+    child is searched.
+
+    The transposition table outlives individual searches, so a TeekoPlayer that
+    keeps one engine for the whole game reuses the previous turn's work.
+
+    Attributes:
+        nodes (int): number of positions visited since the last reset
+        stats (SearchStats): statistics of the last search
+        depth_reached (int): deepest fully completed iteration of the last search
+        pv (list): principal variation of the last completed iteration
+        killers (list): two quiet moves per ply that last caused a cutoff
+        history (list): cutoff scores indexed by move_key(src, dst)
+        tt (TranspositionTable): the transposition table
+        tablebase (Tablebase): optional endgame table; decisive move-phase
+            results are taken from it instead of being searched
+    """
+
+    def __init__(self, tt_size_mb=16, tablebase=None):
+        """
+        Args:
+            tt_size_mb (float): memory budget of the transposition table
+            tablebase (Tablebase): optional endgame table
+        """
+        self.nodes = 0
+        self.stats = SearchStats()
+        self._search_start = 0.0
+        self._tt_counters = (0, 0)
+        self.depth_reached = 0
+        self.pv = []
+        self.deadline = None
+        self.end_time = math.inf
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * NUM_MOVE_KEYS
+        self.tt = TranspositionTable(tt_size_mb)
+        self.tablebase = tablebase
+
+    # Move generation and win detection go through these so that
+    # InstrumentedSearchEngine can time them; for the plain engine they are the
+    # module functions themselves.
+    _generate = staticmethod(bb_moves)
+    _winning_move = staticmethod(SearchBoard.winning_move)
+
+    def reset_stats(self):
+        """ Clears the node counter and statistics between searches """
+        self.nodes = 0
+        self.stats = SearchStats()
+        self._search_start = time.perf_counter()
+        self._tt_counters = (self.tt.hits, self.tt.misses)
+
+    def _finish_stats(self, value, move):
+        stats = self.stats
+        stats.nodes = self.nodes
+        stats.depth_reached = self.depth_reached
+        stats.tt_hits = self.tt.hits - self._tt_counters[0]
+        stats.tt_misses = self.tt.misses - self._tt_counters[1]
+        stats.elapsed = time.perf_counter() - self._search_start
+        stats.value = value
+        stats.move = move
+
+    def clear(self):
+        """ Forgets all search state, e.g. at the start of a new game """
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * NUM_MOVE_KEYS
+        self.tt.clear()
+
+    def search(self, mine, theirs, depth):
+        """ Searches the position with mine to move to a fixed depth.
+
+        Args:
+            mine (int): bitboard of the side to move
+            theirs (int): bitboard of the other side
+            depth (int): number of plies to search
+
+        Returns:
+            tuple: (value, (src, dst)) of the best move found; the move is None
+                only if the side to move has no legal moves
+        """
+        self.reset_stats()
+        self.deadline = None
+        value, move = self._root(SearchBoard(mine, theirs), depth, -math.inf, math.inf)
+        self.depth_reached = depth
+        self._finish_stats(value, move)
+        return value, move
+
+    def iterative_deepening(self, mine, theirs, time_limit, max_depth=MAX_PLY - 1):
+        """ Searches depth 1, 2, 3... until the time budget is spent, a forced
+        result is proven or max_depth is reached. Each iteration starts from the
+        previous iteration's principal variation, which the transposition table
+        hands back as the first move to try at every node along it.
+
+        Depth 1 always runs to completion so a legal move is available however
+        small the budget.
+
+        Args:
+            mine (int): bitboard of the side to move
+            theirs (int): bitboard of the other side
+            time_limit (float): wall-clock budget in seconds
+            max_depth (int): deepest iteration to start
+
+        Returns:
+            tuple: (value, (src, dst)) from the last completed iteration
+        """
+        self.end_time = time.perf_counter() + time_limit
+        self.reset_stats()
+        self.depth_reached = 0
+        best_value, best_move = -math.inf, None
+        for depth in range(1, max_depth + 1):
+            self.deadline = None if depth == 1 else self.end_time
+            try:
+                # a timeout leaves the board mid-search, so every iteration gets a fresh one
+                value, move = self._root(SearchBoard(mine, theirs), depth, -math.inf, math.inf)
+            except SearchTimeout:
+                break
+            best_value, best_move = value, move
+            self.depth_reached = depth
+            self.pv = self._principal_variation(SearchBoard(mine, theirs), move, depth)
+            if abs(value) > WIN_SCORE // 2 or time.perf_counter() >= self.end_time:
+                break
+        self.deadline = None
+        self._finish_stats(best_value, best_move)
+        return best_value, best_move
+
+    def stop(self, after=0.0):
+        """ Moves the end of a running iterative_deepening call to after seconds
+        from now; it then returns the best move of its last completed iteration.
+        Meant to be called from another thread. A stop that lands just as an
+        iteration starts can be lost, so call it again if the search goes on.
+        """
+        self.end_time = time.perf_counter() + after
+        if self.deadline is not None:
+            self.deadline = self.end_time
+
+    def search_move(self, mine, theirs, move, depth, alpha=-math.inf, time_limit=None):
+        """ Searches a single root move, as a unit of work for ParallelSearch.
+
+        Args:
+            mine (int): bitboard of the side to move
+            theirs (int): bitboard of the other side
+            move (tuple): the (src, dst) root move to search
+            depth (int): depth of the whole search, counting the root move
+            alpha (float): score the move has to beat; a move that does not is
+                only proven to be no better than alpha
+            time_limit (float): optional budget in seconds
+
+        Returns:
+            float: the value of the move for the side to move
+        """
+        self.reset_stats()
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        board = SearchBoard(mine, theirs)
+        board.make(*move)
+        try:
+            return -self._alphabeta(board, depth - 1, -math.inf, -alpha, 1)
+        finally:
+            self.deadline = None
+
+    def _principal_variation(self, board, move, depth):
+        """ Follows best moves stored in the transposition table from the root """
+        pv = []
+        while move is not None and len(pv) < depth:
+            src, dst = move
+            pv.append(move)
+            board.make(src, dst)
+            if board.has_won(board.side ^ 1):
+                break
+            entry = self.tt.probe(board.key)
+            move = unpack_move_key(entry[3]) if entry and entry[3] != NO_MOVE else None
+            if move is not None and move not in bb_moves(board.bits[board.side], board.bits[board.side ^ 1]):
+                break
+        return pv
+
+    def _root(self, board, depth, alpha, beta):
+        self.nodes += 1
+        mine, theirs = board.bits
+        win = self._winning_move(board)
+        if win is not None:
+            return WIN_SCORE, win
+        moves = unique_moves(mine, theirs, self._generate(mine, theirs))
+        entry = self.tt.probe(board.key)
+        tt_move = unpack_move_key(entry[3]) if entry and entry[3] != NO_MOVE else None
+        best_value, best_move = -math.inf, None
+        for move in self._order(moves, board, 0, tt_move):
+            board.make(*move)
+            value = -self._alphabeta(board, depth - 1, -beta, -alpha, 1)
+            board.unmake(*move)
+            if value > best_value:
+                best_value, best_move = value, move
+            if value > alpha:
+                alpha = value
+        if best_move is not None:
+            self.tt.store(board.key, _to_tt(best_value, 0), depth, EXACT, move_key(*best_move))
+        return best_value, best_move
+
+    def _alphabeta(self, board, depth, alpha, beta, ply):
+        """ Returns the negamax value of the position for the side to move on board.
+        The previous move is known not to have won the game.
+        """
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 1023 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        side = board.side
+        mine = board.bits[side]
+        theirs = board.bits[side ^ 1]
+        if self.tablebase is not None and mine.bit_count() == PIECES_PER_SIDE == theirs.bit_count():
+            entry = self.tablebase.probe(mine, theirs)
+            if entry is not None and entry[0] != TB_DRAW:
+                # the deciding move is made distance - 1 plies below this node
+                score = WIN_SCORE - (ply + entry[1] - 1)
+                return score if entry[0] == TB_WIN else -score
+        if ply >= MAX_PLY:
+            return self._evaluate(board)
+
+        # Wins and threats are settled before the horizon is, so tactics come out
+        # the same at every depth: a side that can complete a pattern has won, and
+        # a side facing a threat can only block it. At the horizon the forced
+        # blocks are followed for up to THREAT_PLIES more plies (depth goes
+        # negative there) instead of evaluating a position that is about to be
+        # lost or won.
+        tt = self.tt
+        key = board.key
+        win = self._winning_move(board)
+        if win is not None:
+            value = WIN_SCORE - ply
+            tt.store(key, _to_tt(value, ply), MAX_PLY, EXACT, move_key(*win))
+            return value
+        threats = board.threat_cells(side ^ 1)
+        if threats & (threats - 1):
+            # two cells to cover with one move
+            return -(WIN_SCORE - ply - 1)
+        if depth <= 0 and (not threats or depth <= -THREAT_PLIES):
+            return self._evaluate(board)
+
+        tt_move = None
+        if depth > 0:
+            entry = tt.probe(key)
+            if entry is not None:
+                tt_value, tt_depth, bound, tt_mk = entry
+                if tt_depth >= depth:
+                    tt_value = _from_tt(tt_value, ply)
+                    if bound == EXACT:
+                        return tt_value
+                    if bound == LOWER:
+                        if tt_value >= beta:
+                            return tt_value
+                    elif tt_value <= alpha:
+                        return tt_value
+                if tt_mk != NO_MOVE:
+                    tt_move = unpack_move_key(tt_mk)
+
+        moves = self._generate(mine, theirs)
+        if not moves:
+            return self._evaluate(board)
+        if threats:
+            moves = [move for move in moves if threats >> move[1] & 1]
+            if not moves:
+                return -(WIN_SCORE - ply - 1)
+
+        alpha_orig = alpha
+        best_value, best_move = -math.inf, None
+        for move in self._order(moves, board, ply, tt_move):
+            board.make(*move)
+            value = -self._alphabeta(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake(*move)
+            if value > best_value:
+                best_value, best_move = value, move
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        self._record_cutoff(move, max(depth, 0), ply)
+                        break
+
+        if depth > 0:
+            if best_value <= alpha_orig:
+                bound = UPPER
+            elif best_value >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            tt.store(key, _to_tt(best_value, ply), depth, bound, move_key(*best_move))
+        return best_value
+
+    def _evaluate(self, board):
+        # heuristic_game_value favours the root player on ties, so always score
+        # from the root's point of view and flip for the opponent's plies.
+        value = board.evaluate()
+        return -value if board.side else value
+
+    def _order(self, moves, board, ply, tt_move=None):
+        blocks = board.threats(board.side ^ 1)
+        killers = self.killers[ply]
+        history = self.history
+
+        def key(move):
+            src, dst = move
+            return (move == tt_move,
+                    blocks >> dst & 1,
+                    move == killers[0] or move == killers[1],
+                    history[move_key(src, dst)],
+                    CENTRE_BONUS[dst])
+
+        return sorted(moves, key=key, reverse=True)
+
+    def _record_cutoff(self, move, depth, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[move_key(*move)] += depth * depth
+
+
+class InstrumentedSearchEngine(SearchEngine):
+    """ SearchEngine that also records leaf evaluations, cutoffs, branching per ply
+    and the time spent generating moves, checking for wins and evaluating leaves.
+    The timing makes it noticeably slower, so it is only used when asked for.
+    """
+
+    def _generate(self, mine, theirs):
+        start = time.perf_counter()
+        moves = bb_moves(mine, theirs)
+        self.stats.time_generate += time.perf_counter() - start
+        return moves
+
+    def _winning_move(self, board):
+        start = time.perf_counter()
+        move = board.winning_move()
+        self.stats.time_win_check += time.perf_counter() - start
+        return move
+
+    def _evaluate(self, board):
+        start = time.perf_counter()
+        value = super()._evaluate(board)
+        stats = self.stats
+        stats.time_evaluate += time.perf_counter() - start
+        stats.leaf_evaluations += 1
+        return value
+
+    def _order(self, moves, board, ply, tt_move=None):
+        stats = self.stats
+        stats.expanded[ply] += 1
+        stats.children[ply] += len(moves)
+        return super()._order(moves, board, ply, tt_move)
+
+    def _record_cutoff(self, move, depth, ply):
+        self.stats.cutoffs += 1
+        super()._record_cutoff(move, depth, ply)
+
+
+############################################################################
+#
+# PARALLEL ROOT SEARCH
+#
+############################################################################
+# Each worker process keeps one SearchEngine for its lifetime, so its
+# transposition table carries over from one task and one call to the next.
+_worker_engine = None
+
+
+def _parallel_worker_init(tt_size_mb, tablebase_path):
+    global _worker_engine
+    tablebase = Tablebase.open(tablebase_path) if tablebase_path else None
+    _worker_engine = SearchEngine(tt_size_mb, tablebase)
+
+
+def _parallel_worker_search(mine, theirs, move, depth, alpha, deadline):
+    # deadline is wall-clock time, since tasks can wait in the queue for a while
+    time_limit = None
+    if deadline is not None:
+        time_limit = deadline - time.time()
+        if time_limit <= 0:
+            return None, 0
+    try:
+        value = _worker_engine.search_move(mine, theirs, move, depth, alpha, time_limit)
+    except SearchTimeout:
+        value = None
+    return value, _worker_engine.nodes
+
+
+class ParallelSearch:
+    """ Root-splitting search over a pool of worker processes.
+
+    The root moves are ordered as in SearchEngine. The first move is searched
+    with a full window, and the remaining moves are then searched in parallel
+    with that score as their lower bound, so most of them fail low quickly.
+    Results are merged in root-move order rather than completion order: the
+    best move is the first one with the highest value, whichever worker
+    finished first. The pool is created on first use and reused until close().
+
+    Attributes:
+        workers (int): number of worker processes
+        nodes (int): positions visited by all workers during the last search
+        depth_reached (int): deepest fully completed iteration of the last search
+        stats (SearchStats): nodes, depth, elapsed time, value and move of the
+            last iterative_deepening call
+        values (dict): score of every root move in the last completed search;
+            moves that failed low hold an upper bound
+    """
+
+    def __init__(self, workers=None, tt_size_mb=16, tablebase_path=None):
+        """
+        Args:
+            workers (int): worker processes; defaults to the number of CPUs
+            tt_size_mb (float): transposition table budget of each worker
+            tablebase_path (str): tablebase each worker opens, if any
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.tt_size_mb = tt_size_mb
+        self.tablebase_path = tablebase_path
+        self.nodes = 0
+        self.depth_reached = 0
+        self.stats = SearchStats()
+        self.values = {}
+        self._pool = None
+        self._orderer = SearchEngine(tt_size_mb=0)
+
+    def _get_pool(self):
+        if self._pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_parallel_worker_init,
+                                             initargs=(self.tt_size_mb, self.tablebase_path))
+        return self._pool
+
+    def close(self):
+        """ Shuts the worker processes down """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search(self, mine, theirs, depth, time_limit=None, moves=None):
+        """ Searches the position with mine to move to a fixed depth.
+
+        Args:
+            mine (int): bitboard of the side to move
+            theirs (int): bitboard of the other side
+            depth (int): number of plies to search
+            time_limit (float): optional budget in seconds; SearchTimeout is
+                raised if the search does not finish in time
+            moves (list): root moves in the order to try them; defaults to
+                SearchEngine's ordering
+
+        Returns:
+            tuple: (value, (src, dst)) of the best move found
+        """
+        deadline = None if time_limit is None else time.time() + time_limit
+        self.nodes = 0
+        all_moves = bb_moves(mine, theirs)
+        for src, dst in all_moves:
+            if bb_wins_at(bb_apply(mine, src, dst), dst):
+                return WIN_SCORE, (src, dst)
+        if moves is None:
+            moves = self._orderer._order(unique_moves(mine, theirs, all_moves),
+                                         SearchBoard(mine, theirs), 0)
+        if not moves:
+            return -math.inf, None
+        pool = self._get_pool()
+        first = pool.submit(_parallel_worker_search, mine, theirs, moves[0], depth, -math.inf, deadline)
+        best_value, nodes = first.result()
+        self.nodes += nodes
+        if best_value is None:
+            raise SearchTimeout()
+        best_move = moves[0]
+        self.values = {moves[0]: best_value}
+        futures = [pool.submit(_parallel_worker_search, mine, theirs, move, depth, best_value, deadline)
+                   for move in moves[1:]]
+        for move, future in zip(moves[1:], futures):
+            value, nodes = future.result()
+            self.nodes += nodes
+            if value is None:
+                for pending in futures:
+                    pending.cancel()
+                raise SearchTimeout()
+            self.values[move] = value
+            if value > best_value:
+                best_value, best_move = value, move
+        return best_value, best_move
+
+    def iterative_deepening(self, mine, theirs, time_limit, max_depth=MAX_PLY - 1):
+        """ Parallel counterpart of SearchEngine.iterative_deepening. Each iteration
+        tries the root moves in the order of the previous iteration's scores.
+
+        Returns:
+            tuple: (value, (src, dst)) from the last completed iteration
+        """
+        start = time.perf_counter()
+        self.depth_reached = 0
+        best_value, best_move = -math.inf, None
+        moves = None
+        nodes = 0
+        for depth in range(1, max_depth + 1):
+            left = None if depth == 1 else start + time_limit - time.perf_counter()
+            try:
+                value, move = self.search(mine, theirs, depth, left, moves)
+            except SearchTimeout:
+                nodes += self.nodes
+                break
+            nodes += self.nodes
+            best_value, best_move = value, move
+            self.depth_reached = depth
+            if abs(value) > WIN_SCORE // 2 or time.perf_counter() - start >= time_limit:
+                break
+            # stable sort keeps the previous order among equal scores
+            moves = sorted(self.values, key=self.values.get, reverse=True)
+        self.nodes = nodes
+        stats = self.stats = SearchStats()
+        stats.nodes = nodes
+        stats.depth_reached = self.depth_reached
+        stats.elapsed = time.perf_counter() - start
+        stats.value, stats.move = best_value, best_move
+        return best_value, best_move
+
+
+############################################################################
+#
+# PONDERING
+#
+############################################################################
+
+class Ponder:
+    """ A search run in a background thread on the opponent's time.
+
+    After choosing a move, the engine guesses the opponent's reply from its
+    principal variation and searches the position that reply would leave it in.
+    If the opponent plays the guess (a ponder hit), the search simply continues
+    and its result is picked up on the next turn. Otherwise the search is stopped
+    (a ponder miss), but the transposition table keeps what it learned about the
+    positions the two lines share.
+
+    The engine must not be used by anyone else until the ponder has finished.
+
+    Attributes:
+        expected (tuple): the (src, dst) reply the ponder is betting on
+        position (tuple): (mine, theirs) bitboards after that reply
+        hit (bool): whether the opponent has played expected
+        started (float): time.perf_counter() when the search began
+        result (tuple): (value, (src, dst)) once the search has returned
+    """
+
+    def __init__(self, engine, mine, theirs, expected, max_depth=MAX_PLY - 1):
+        """
+        Args:
+            engine (SearchEngine): the engine to search with
+            mine (int): bitboard of the pondering side after the expected reply
+            theirs (int): bitboard of the opponent after the expected reply
+            expected (tuple): the opponent's expected (src, dst) reply
+            max_depth (int): deepest iteration to search
+        """
+        self.engine = engine
+        self.expected = expected
+        self.position = (mine, theirs)
+        self.hit = False
+        self.started = time.perf_counter()
+        self.result = None
+        self._thread = threading.Thread(target=self._run, args=(max_depth,), daemon=True)
+        self._thread.start()
+
+    def _run(self, max_depth):
+        self.result = self.engine.iterative_deepening(*self.position, math.inf, max_depth)
+
+    def finish(self, time_limit=0.0):
+        """ Lets the search run for up to time_limit more seconds, then stops it.
+
+        Returns:
+            tuple: (value, (src, dst)) of the deepest completed iteration
+        """
+        self.engine.stop(time_limit)
+        self._thread.join(time_limit)
+        while self._thread.is_alive():
+            self.engine.stop()
+            self._thread.join(0.01)
+        return self.result
+
 
 class TeekoPlayer:
     """ An object representation for an AI game player for the game Teeko.
     """
-    board = [[' ' for j in range(5)] for i in range(5)]
     pieces = ['b', 'r']
 
-    def __init__(self):
+    def __init__(self, workers=1, instrument=False, stats_callback=None, ponder=False):
         """ Initializes a TeekoPlayer object by randomly selecting red or black as its
         piece color.r
+
+        Args:
+            workers (int): number of processes to search with; more than one
+                starts a ParallelSearch pool on the first search
+            instrument (bool): search with an InstrumentedSearchEngine, which also
+                records cutoffs, branching and time per function (single process only)
+            stats_callback (callable): called with the SearchStats of every move
+                that needed a search
+            ponder (bool): keep searching in a background thread while the
+                opponent thinks (see Ponder); single process only
         """
+        self.board = [[' ' for j in range(5)] for i in range(5)]
         self.my_piece = random.choice(self.pieces)
         self.dropCount = 0
         self.opp = self.pieces[0] if self.my_piece == self.pieces[1] else self.pieces[1]
+        self.depth_limit = MAX_PLY - 1
+        self.time_limit = 0.5
+        self._engine_class = InstrumentedSearchEngine if instrument else SearchEngine
+        self.stats_callback = stats_callback
+        self.last_stats = None
+        self.parallel = None
+        if workers > 1:
+            self.parallel = ParallelSearch(workers, tablebase_path=self.tablebase and self.tablebase.path)
+        self.ponder = ponder and self.parallel is None
+        self._ponder = None
+        self.nodes = 0
+
+    # The book, the tablebase and the engine are created on first use, so that
+    # constructing a player is cheap and a game that never searches never
+    # allocates a transposition table. Each can still be assigned, e.g. set to
+    # None to play without the book.
+    @cached_property
+    def tablebase(self):
+        return Tablebase.open()
+
+    @cached_property
+    def book(self):
+        return OpeningBook.open()
+
+    @cached_property
+    def engine(self):
+        return self._engine_class(tablebase=self.tablebase)
 
     def run_challenge_test(self):
         # Set to True if you would like to run gradescope against the challenge AI!
@@ -22,7 +1814,7 @@ class TeekoPlayer:
         # You can still get full credit with this set to False
         return True
 
-    def make_move(self, state):
+    def make_move(self, state, time_limit=None):
         """ Selects a (row, col) space for the next move. You may assume that whenever
         this function is called, it is this player's turn to move.
 
@@ -35,6 +1827,12 @@ class TeekoPlayer:
 
                 In the "drop phase", the state will contain less than 8 elements which
                 are not ' ' (a single space character).
+            time_limit (float): wall-clock budget for the search in seconds; defaults
+                to self.time_limit. The search deepens iteratively and answers with
+                the best move of the deepest iteration that finished in time.
+                Afterwards self.last_stats holds the SearchStats of that search, or
+                None if the move came from the opening book, the tablebase or the
+                drop-phase opening rules.
 
         Return:
             move (list): a list of move tuples such that its format is
@@ -48,42 +1846,24 @@ class TeekoPlayer:
             and will eventually take over the board. This is not a valid strategy and
             will earn you no points.
         """
+        self.last_stats = None
+        if time_limit is None:
+            time_limit = self.time_limit
+        pondered = self._end_ponder(state, time_limit)
 
-        
-        best_move = None
-        best_value = - math.inf  # Start with the worst possible value
         # drop phase behavior  
         drop_phase = sum(row.count('b') + row.count('r') for row in state) < 8
         
-        def find_winning_move(player_piece):
-            """Find a winning move for the given player."""
-            for row in range(5):
-                for col in range(5):
-                    if state[row][col] == ' ':
-                        # Simulate placing the player's piece
-                        simulated_state = [r.copy() for r in state]
-                        simulated_state[row][col] = player_piece
-                        if self.game_value(simulated_state) == (1 if player_piece == self.my_piece else -1):
-                            return (row, col)
-            return None
-        
         if drop_phase:
+            # Play from the opening book while the position is in it
+            if self.book is not None:
+                book_move = self.book.lookup(bits_from_board(state, self.my_piece),
+                                             bits_from_board(state, self.opp))
+                if book_move is not None:
+                    return move_from_indices(*book_move)
+
             opp_count = sum(row.count(self.opp) for row in state)
             my_count = sum(row.count(self.my_piece) for row in state)
-            my_winning_move = find_winning_move(self.my_piece)
-            if my_winning_move:
-                return [my_winning_move]  # Take the winning move
-            # Defensive drop phase behavior: Block opponent threats
-            for row in range(5):
-                for col in range(5):
-                    if state[row][col] == ' ':
-                        # Simulate opponent move
-                        simulated_state = [row.copy() for row in state]
-                        simulated_state[row][col] = self.opp
-                        if self.game_value(simulated_state) == -1:  # Opponent wins here
-                            return [(row, col)]  # Block this move immediately
-                        
-            
             if opp_count == 2 and my_count == 1:
                 # Check rows
                 for row in range(5):
@@ -138,60 +1918,36 @@ class TeekoPlayer:
                 for pos in [(2, 1), (2, 3), (1, 2), (3, 2), (1, 1), (1, 3), (3, 1), (3, 3)]:
                     if state[pos[0]][pos[1]] == ' ':
                         return [pos]
-             # Non-drop phase: Hardcoded actions
+             # Non-drop phase
         if not drop_phase:
             
-            # 2. Secure our winning move
-            my_winning_move = find_winning_move(self.my_piece)
-            if my_winning_move:
-                row, col = my_winning_move
-                for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                    source_row, source_col = row + dr, col + dc
-                    if (
-                        0 <= source_row < 5 and 0 <= source_col < 5 and  # Within board boundaries
-                        state[source_row][source_col] == self.my_piece  # Is our piece
-                    ):
-                        # Simulate the move to ensure it maintains a winning pattern
-                        simulated_state = [r.copy() for r in state]
-                        simulated_state[source_row][source_col] = ' '  # Remove the piece from its current spot
-                        simulated_state[row][col] = self.my_piece  # Place it in the winning spot
-                        if self.game_value(simulated_state) == 1:  # Check if this move leads to a win
-                            print("this is happening")
-                            return [(row, col), (source_row, source_col)]  # Move to secure win
-            
-            # 1. Block opponent's winning move
-            opp_winning_move = find_winning_move(self.opp)
-            if opp_winning_move:
-                row, col = opp_winning_move
-                
-                # Check if any of the opponent's pieces is adjacent to the winning square
-                for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                    adj_row, adj_col = row + dr, col + dc
-                    if (
-                        0 <= adj_row < 5 and 0 <= adj_col < 5 and  # Within board boundaries
-                        state[adj_row][adj_col] == self.opp  # Opponent's piece is adjacent
-                    ):
-                        # Now find one of our pieces adjacent to the winning square to block
-                        for dr2, dc2 in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                            source_row, source_col = row + dr2, col + dc2
-                            if (
-                                0 <= source_row < 5 and 0 <= source_col < 5 and  # Within board boundaries
-                                state[source_row][source_col] == self.my_piece  # Our piece is adjacent
-                            ):
-                                print("This is happening")
-                                return [(row, col), (source_row, source_col)]  # Move to block
+            # Answer from the endgame tablebase when it knows the position
+            if self.tablebase is not None:
+                tb_move = self.tablebase.best_move(bits_from_board(state, self.my_piece),
+                                                   bits_from_board(state, self.opp))
+                if tb_move is not None:
+                    return move_from_indices(*tb_move)
 
-        
-        
-        
-        for succ_state in self.succ(state):
-            move_value = self.max_value(succ_state, 1, depth_limit=3)  # Start depth at 1
-            if move_value > best_value:
-                best_value = move_value
-                best_move = succ_state  # Update to the best state
-        
-        # Extract the move from the best state (this needs to map back to move format)
-        return self.extract_move(state, best_move)
+        mine = bits_from_board(state, self.my_piece)
+        theirs = bits_from_board(state, self.opp)
+        search = self.parallel if self.parallel is not None else self.engine
+        if pondered is not None:
+            best_value, best_move = pondered
+        else:
+            best_value, best_move = search.iterative_deepening(mine, theirs, time_limit, self.depth_limit)
+        stats = self.last_stats = search.stats
+        if self.stats_callback is not None:
+            self.stats_callback(stats)
+        # logging is slow to import, so it is left to the application: if nothing
+        # imported it, nothing can have enabled debug output either.
+        logging = sys.modules.get('logging')
+        if logging is not None and logging.getLogger(__name__).isEnabledFor(logging.DEBUG):
+            logging.getLogger(__name__).debug('search stats: %r', stats)
+        if self.ponder:
+            self._start_ponder(mine, theirs, best_move)
+
+        # Map the best (src, dst) pair back to the [(row, col), (src_row, src_col)] format
+        return move_from_indices(*best_move)
     
     
     def extract_move(self, old_state, new_state):
@@ -240,38 +1996,75 @@ class TeekoPlayer:
                 raise Exception('Illegal move: Can only move to an adjacent space')
         if self.board[move[0][0]][move[0][1]] != ' ':
             raise Exception("Illegal move detected")
+        if self._ponder is not None:
+            dst = move[0][0] * BOARD_SIZE + move[0][1]
+            src = move[1][0] * BOARD_SIZE + move[1][1] if len(move) > 1 and move[1][0] is not None else None
+            self._ponder.hit = (src, dst) == self._ponder.expected
         # make move
         self.place_piece(move, self.opp)
-        
-    def succ(self, state):
-        successors = []
-        drop_phase = sum(row.count('b') + row.count('r') for row in state) < 8
-        
-        if drop_phase:
-            # Drop phase: Add a new piece to an unoccupied space
-            for row in range(5):
-                for col in range(5):
-                    if state[row][col] == ' ':
-                        new_state = [row.copy() for row in state]
-                        new_state[row][col] = self.my_piece
-                        successors.append(new_state)
-                        
-        else:
-            # Move phase: Move a piece to an adjacent unoccupied space
-            for row in range(5):
-                for col in range(5):
-                    if state[row][col] == self.my_piece:
-                        # Check adjacent spaces
-                        for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
-                            new_row, new_col = row + dr, col + dc
-                            if 0 <= new_row < 5 and 0 <= new_col < 5 and state[new_row][new_col] == ' ':
-                                new_state = [row.copy() for row in state]
-                                new_state[row][col] = ' '  # Remove piece from old location
-                                new_state[new_row][new_col] = self.my_piece  # Place piece in new location
-                                successors.append(new_state)
-        return successors
 
+    def _start_ponder(self, mine, theirs, move):
+        """ Starts pondering on the reply the principal variation expects to move """
+        pv = self.engine.pv
+        if len(pv) < 2 or pv[0] != move:
+            return
+        mine = bb_apply(mine, *move)
+        if bb_wins_at(mine, move[1]):
+            return
+        reply = pv[1]
+        theirs = bb_apply(theirs, *reply)
+        if bb_wins_at(theirs, reply[1]):
+            return
+        # a position the book or tablebase answers needs no search
+        if (mine | theirs).bit_count() < 2 * PIECES_PER_SIDE:
+            if self.book is not None and self.book.lookup(mine, theirs) is not None:
+                return
+        elif self.tablebase is not None and self.tablebase.probe(mine, theirs) is not None:
+            return
+        self._ponder = Ponder(self.engine, mine, theirs, reply, self.depth_limit)
+
+    def _end_ponder(self, state, time_limit):
+        """ Stops pondering. After a ponder hit the search first gets whatever is
+        left of time_limit, counting the time it has already run.
+
+        Returns:
+            tuple: the pondered (value, (src, dst)) if it searched state, else None
+        """
+        ponder, self._ponder = self._ponder, None
+        if ponder is None:
+            return None
+        if ponder.hit and ponder.position == (bits_from_board(state, self.my_piece),
+                                              bits_from_board(state, self.opp)):
+            return ponder.finish(max(0.0, time_limit - (time.perf_counter() - ponder.started)))
+        ponder.finish()
+        return None
+
+    def stop_pondering(self):
+        """ Stops any background search, e.g. when the game is over """
+        ponder, self._ponder = self._ponder, None
+        if ponder is not None:
+            ponder.finish()
         
+    def succ(self, state, unique=False, piece=None):
+        """ Generates the successors of state reachable by one move.
+
+        Args:
+            state (list of lists): the current board state
+            unique (bool): if True, keep only one successor out of every group that
+                are symmetric to each other (see unique_moves)
+            piece (str): the colour to move; defaults to this player's
+
+        Returns:
+            list: the successor boards, each a new list of lists
+        """
+        if piece is None:
+            piece = self.my_piece
+        moves = generate_moves(state, piece)
+        if unique:
+            moves = unique_moves(bits_from_board(state, piece),
+                                 bits_from_board(state, other_piece(piece)), moves)
+        return [apply_move(state, move, piece) for move in moves]
+
     def heuristic_game_value(self, state):
         """Evaluates the heuristic value of the game state, prioritizing the center of the board.
 
@@ -281,52 +2074,7 @@ class TeekoPlayer:
         Returns:
             float: A heuristic value representing the favorability of the state for the AI.
         """
-        my_score = 0
-        opp_score = 0
-
-        # Order of evaluation: Start from the center and move outward
-        positions = [
-            (2, 2),  # Center
-            (2, 1), (2, 3), (1, 2), (3, 2),  # Immediate neighbors of the center
-            (1, 1), (1, 3), (3, 1), (3, 3),  # Diagonals around the center
-            (0, 2), (4, 2), (2, 0), (2, 4),  # Vertical and horizontal lines from the center
-            (0, 1), (0, 3), (1, 0), (1, 4), (3, 0), (3, 4), (4, 1), (4, 3),  # Outer neighbors
-            (0, 0), (0, 4), (4, 0), (4, 4)   # Corners
-        ]
-
-        # Evaluate horizontal and vertical lines
-        for row, col in positions:
-            if col <= 1:  # Horizontal lines starting from this column
-                my_score = max(my_score, state[row][col:col+4].count(self.my_piece))
-                opp_score = max(opp_score, state[row][col:col+4].count(self.opp))
-            if row <= 1:  # Vertical lines starting from this row
-                col_pattern = [state[row+k][col] for k in range(4) if row+k < 5]
-                my_score = max(my_score, col_pattern.count(self.my_piece))
-                opp_score = max(opp_score, col_pattern.count(self.opp))
-
-        # Evaluate diagonals
-        for row, col in positions:
-            if 0 <= row <= 1 and 0 <= col <= 1:  # Diagonal (top-left to bottom-right)
-                diag1_pattern = [state[row+k][col+k] for k in range(4) if row+k < 5 and col+k < 5]
-                my_score = max(my_score, diag1_pattern.count(self.my_piece))
-                opp_score = max(opp_score, diag1_pattern.count(self.opp))
-            if 0 <= row <= 1 and 3 <= col <= 4:  # Diagonal (top-right to bottom-left)
-                diag2_pattern = [state[row+k][col-k] for k in range(4) if row+k < 5 and col-k >= 0]
-                my_score = max(my_score, diag2_pattern.count(self.my_piece))
-                opp_score = max(opp_score, diag2_pattern.count(self.opp))
-
-        # Evaluate 2x2 boxes
-        for row, col in positions:
-            if row < 4 and col < 4:
-                box_pattern = [
-                    state[row][col], state[row][col+1],
-                    state[row+1][col], state[row+1][col+1]
-                ]
-                my_score = max(my_score, box_pattern.count(self.my_piece))
-                opp_score = max(opp_score, box_pattern.count(self.opp))
-
-        # Normalize scores for heuristic
-        return my_score / 4 if my_score >= opp_score else opp_score / -4
+        return bb_heuristic(bits_from_board(state, self.my_piece), bits_from_board(state, self.opp))
         
         
 
@@ -369,20 +2117,12 @@ class TeekoPlayer:
         Returns:
             float: The heuristic value of the state.
         """
-        # Check for terminal state or depth limit
         game_val = self.game_value(state)
-        if game_val != 0:  # Terminal stateC
+        if game_val != 0:  # Terminal state
             return game_val
-        if depth >= depth_limit:
-            return self.heuristic_game_value(state)
+        return self.bb_min_value(bits_from_board(state, self.my_piece),
+                                 bits_from_board(state, self.opp), depth, depth_limit)
 
-        min_val = math.inf
-        for succ_state in self.succ(state):
-            min_val = min(min_val, self.max_value(succ_state, depth + 1, depth_limit))
-            if min_val == -1:  # Opponent has a guaranteed win, prune
-                break
-        return min_val
-    
     def max_value(self, state, depth, depth_limit=2):
         """Implements the max_value function of the minimax algorithm.
 
@@ -394,18 +2134,61 @@ class TeekoPlayer:
         Returns:
             float: The heuristic value of the state.
         """
-        # Check for terminal state or depth limit
         game_val = self.game_value(state)
         if game_val != 0:  # Terminal state
             return game_val
+        return self.bb_max_value(bits_from_board(state, self.my_piece),
+                                 bits_from_board(state, self.opp), depth, depth_limit)
+
+    def bb_min_value(self, mine, theirs, depth, depth_limit=2):
+        """Bitboard min node: the opponent is to move. Callers must have checked
+        that the position is not already won. This plain minimax is kept as the
+        reference for SearchEngine; both count visited positions in nodes.
+
+        Args:
+            mine (int): bitboard of this player's pieces.
+            theirs (int): bitboard of the opponent's pieces.
+            depth (int): The current depth of recursion.
+            depth_limit (int): The maximum depth to explore.
+
+        Returns:
+            float: The heuristic value of the state.
+        """
+        self.nodes += 1
+        if depth >= depth_limit:
+            return bb_heuristic(mine, theirs)
+
+        min_val = math.inf
+        for src, dst in bb_moves(theirs, mine):
+            child = bb_apply(theirs, src, dst)
+            if bb_wins_at(child, dst):  # Opponent has a guaranteed win, prune
+                return -1
+            min_val = min(min_val, self.bb_max_value(mine, child, depth + 1, depth_limit))
+        return min_val
+
+    def bb_max_value(self, mine, theirs, depth, depth_limit=2):
+        """Bitboard max node: this player is to move. Callers must have checked
+        that the position is not already won.
+
+        Args:
+            mine (int): bitboard of this player's pieces.
+            theirs (int): bitboard of the opponent's pieces.
+            depth (int): The current depth of recursion.
+            depth_limit (int): The maximum depth to explore.
+
+        Returns:
+            float: The heuristic value of the state.
+        """
+        self.nodes += 1
         if depth >= depth_limit:
-            return self.heuristic_game_value(state)
+            return bb_heuristic(mine, theirs)
 
         max_val = -math.inf
-        for succ_state in self.succ(state):
-            max_val = max(max_val, self.min_value(succ_state, depth + 1, depth_limit))
-            if max_val == 1:  # AI has a guaranteed win, prune
-                break
+        for src, dst in bb_moves(mine, theirs):
+            child = bb_apply(mine, src, dst)
+            if bb_wins_at(child, dst):  # AI has a guaranteed win, prune
+                return 1
+            max_val = max(max_val, self.bb_min_value(child, theirs, depth + 1, depth_limit))
         return max_val
 
     def game_value(self, state):
@@ -418,43 +2201,227 @@ class TeekoPlayer:
 
         Returns:
             int: 1 if this TeekoPlayer wins, -1 if the opponent wins, 0 if no winner
+        """
+        if bb_is_win(bits_from_board(state, self.my_piece)):
+            return 1
+        if bb_is_win(bits_from_board(state, self.opp)):
+            return -1
+        return 0 # no winner yet
+
+
+############################################################################
+#
+# GAME SESSIONS
+#
+############################################################################
+
+class GameState:
+    """ The state of one game, small enough to keep thousands of them around.
+
+    The board is a pair of bitboards; everything else a game needs (the search
+    engine, book and tablebase) lives in a SessionManager and is shared.
+
+    Attributes:
+        black (int): bitboard of black's pieces
+        red (int): bitboard of red's pieces
+        side (int): 0 when black is to move, 1 when red is
+        plies (int): moves made so far
+    """
+
+    __slots__ = ('black', 'red', 'side', 'plies')
+
+    def __init__(self, black=0, red=0, side=0, plies=0):
+        self.black = black
+        self.red = red
+        self.side = side
+        self.plies = plies
+
+    @classmethod
+    def from_board(cls, state, piece, plies=0):
+        """ Builds a GameState from a list-of-lists board with piece to move """
+        return cls(bits_from_board(state, 'b'), bits_from_board(state, 'r'),
+                   TeekoPlayer.pieces.index(piece), plies)
 
-        TODO: complete checks for diagonal and box wins
+    @property
+    def piece(self):
+        """ The colour to move, 'b' or 'r' """
+        return TeekoPlayer.pieces[self.side]
+
+    @property
+    def bits(self):
+        """ (mine, theirs) bitboards from the point of view of the side to move """
+        return (self.red, self.black) if self.side else (self.black, self.red)
+
+    def board(self):
+        """ The position as a new list-of-lists board """
+        return board_from_bits(self.black, self.red)
+
+    def drop_phase(self):
+        return (self.black | self.red).bit_count() < 2 * PIECES_PER_SIDE
+
+    def winner(self):
+        """ Returns 'b' or 'r' once that colour has won, otherwise None """
+        if bb_is_win(self.black):
+            return 'b'
+        if bb_is_win(self.red):
+            return 'r'
+        return None
+
+    def moves(self):
+        """ Every legal move of the side to move, as Move objects """
+        return [Move(src, dst) for src, dst in bb_moves(*self.bits)]
+
+    def validate(self, move):
+        """ Checks a move of the side to move with the same rules as
+        TeekoPlayer.opponent_move, and also that it fits the game phase.
+
+        Args:
+            move: a Move or (src, dst) pair, or a move in TeekoPlayer's list format
+
+        Returns:
+            Move: the move
+
+        Raises:
+            ValueError: if the move is illegal or the game is already over
         """
-        # check horizontal wins
-        for row in state:
-            for i in range(2):
-                if row[i] != ' ' and row[i] == row[i+1] == row[i+2] == row[i+3]:
-                    return 1 if row[i]==self.my_piece else -1
+        if not (isinstance(move, tuple) and len(move) == 2
+                and all(cell is None or isinstance(cell, int) for cell in move)):
+            move = Move.from_list(move)
+        src, dst = move
+        mine, theirs = self.bits
+        if self.winner() is not None:
+            raise ValueError("The game is over")
+        for cell in (src, dst):
+            if cell is not None and not 0 <= cell < NUM_CELLS:
+                raise ValueError("Illegal move: off the board")
+        if (src is None) != self.drop_phase():
+            raise ValueError("Illegal move: pieces are dropped until 8 are on the board, "
+                             "then moved")
+        if src is not None:
+            if not mine >> src & 1:
+                raise ValueError("You don't have a piece there!")
+            if not ADJACENT[src] >> dst & 1:
+                raise ValueError("Illegal move: Can only move to an adjacent space")
+        if (mine | theirs) >> dst & 1:
+            raise ValueError("Illegal move detected")
+        return Move(src, dst)
 
-        # check vertical wins
-        for col in range(5):
-            for i in range(2):
-                if state[i][col] != ' ' and state[i][col] == state[i+1][col] == state[i+2][col] == state[i+3][col]:
-                    return 1 if state[i][col]==self.my_piece else -1
-        # Check \ diagonal wins
-        for row in range(2):
-            for col in range(2, 5):
-                if state[row][col] != ' ' and state[row][col] == state[row+1][col-1] == state[row+2][col-2] == state[row+3][col-3]:
-                    return 1 if state[row][col] == self.my_piece else -1
+    def play(self, move):
+        """ Validates and makes a move of the side to move.
 
-        # Check / diagonal wins
-        for row in range(2):
-            for col in range(2):
-                if state[row][col] != ' ' and state[row][col] == state[row+1][col+1] == state[row+2][col+2] == state[row+3][col+3]:
-                    return 1 if state[row][col] == self.my_piece else -1
-                
-        for row in range(4):
-            for col in range(4):
-                if state[row][col] != ' ' and state[row][col] == state[row][col+1] == state[row+1][col] == state[row+1][col+1]:
-                    return 1 if state[row][col] == self.my_piece else -1
+        Returns:
+            Move: the move made
+        """
+        move = self.validate(move)
+        if self.side:
+            self.red = bb_apply(self.red, *move)
+        else:
+            self.black = bb_apply(self.black, *move)
+        self.side ^= 1
+        self.plies += 1
+        return move
 
+    def __repr__(self):
+        return 'GameState(black=%#09x, red=%#09x, side=%d, plies=%d)' % (
+            self.black, self.red, self.side, self.plies)
 
-        # TODO: check \ diagonal wins
-        # TODO: check / diagonal wins
-        # TODO: check box wins
 
-        return 0 # no winner yet
+class SessionManager:
+    """ Hosts many games in one process.
+
+    Every game is just a GameState. The search engine (with its transposition
+    table), opening book and tablebase are opened once and shared by all games.
+    Transposition table entries are keyed by position, so games also profit from
+    each other's searches. The player is created on the first engine move, so a
+    manager that only keeps track of games never opens them. Engine moves are
+    computed one at a time under a lock, so the manager can be used from several
+    threads. Game ids come from an itertools.count, so starting a game never
+    waits for a search.
+
+    Attributes:
+        games (dict): game id -> GameState
+        player (TeekoPlayer): the player whose make_move answers every game,
+            created on first use
+    """
+
+    def __init__(self, time_limit=0.5, depth_limit=MAX_PLY - 1, tt_size_mb=16):
+        """
+        Args:
+            time_limit (float): default seconds per engine move
+            depth_limit (int): deepest search iteration
+            tt_size_mb (float): size of the shared transposition table
+        """
+        self.games = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.time_limit = time_limit
+        self.depth_limit = depth_limit
+        self.tt_size_mb = tt_size_mb
+
+    @cached_property
+    def player(self):
+        player = TeekoPlayer()
+        player.engine = SearchEngine(self.tt_size_mb, tablebase=player.tablebase)
+        player.time_limit = self.time_limit
+        player.depth_limit = self.depth_limit
+        return player
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    def new_game(self):
+        """ Starts a game from the empty board, black to move.
+
+        Returns:
+            int: the new game's id
+        """
+        game_id = next(self._ids)
+        self.games[game_id] = GameState()
+        return game_id
+
+    def end_game(self, game_id):
+        """ Forgets a game """
+        del self.games[game_id]
+
+    def play(self, game_id, move):
+        """ Validates and makes a move for the side to move in a game.
+
+        Returns:
+            Move: the move made
+
+        Raises:
+            KeyError: if there is no such game
+            ValueError: if the move is illegal
+        """
+        return self.games[game_id].play(move)
+
+    def choose_move(self, game, time_limit=None):
+        """ The engine's move for the side to move in a GameState, which need
+        not be one of this manager's games. The game is not changed.
+
+        Returns:
+            Move: the chosen move
+        """
+        if game.winner() is not None:
+            raise ValueError("The game is over")
+        with self._lock:
+            player = self.player
+            player.my_piece = game.piece
+            player.opp = other_piece(game.piece)
+            return Move.from_list(player.make_move(game.board(), time_limit))
+
+    def engine_move(self, game_id, time_limit=None):
+        """ Lets the engine choose and make the move of the side to move.
+
+        Returns:
+            Move: the move made
+        """
+        game = self.games[game_id]
+        return game.play(self.choose_move(game, time_limit))
+
 
 ############################################################################
 #
@@ -463,7 +2430,7 @@ class TeekoPlayer:
 ############################################################################
 def main():
     print('Hello, this is Samaritan')
-    ai = TeekoPlayer()
+    ai = TeekoPlayer(ponder=True)
     piece_count = 0
     turn = 0
 
@@ -532,6 +2499,7 @@ def main():
         turn += 1
         turn %= 2
 
+    ai.stop_pondering()
     ai.print_board()
     if ai.game_value(ai.board) == 1:
         print("AI wins! Game over.")
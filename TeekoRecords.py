@@ -0,0 +1,515 @@
+""" Compact binary game records, with an index from positions to games.
+
+A record file starts with a header (magic b'TKGR', version, flags, game count)
+followed by one record per game:
+    plies     number of moves, as an unsigned LEB128 varint
+    result    one byte: UNFINISHED, BLACK_WINS, RED_WINS or DRAW
+    moves     one byte per move
+The first eight moves are drops, stored as the destination cell (0-24). Every
+later move is a slide, stored as source cell * 8 + direction, which is below
+200. The phase follows from the move number, so a typical game fits in about
+30 bytes.
+
+Records are written and read as a stream; a file being written can be read up
+to its last complete record. The game count in the header is filled in when a
+writer is closed and is informational only. Opening a file for appending drops
+any partial record at its end.
+
+GameIndex maps every position reached in a file to the offsets of the games
+that reach it. It is stored next to the records (games.tkg.idx) as two sorted
+arrays, so a lookup is a binary search rather than a scan of the records. The
+index also records how many bytes of the record file it covers; once games are
+appended it no longer matches the file, and GameIndex.open rebuilds it.
+
+Replay works on bitboards with one table lookup and an XOR per move. It yields
+the same positions that place_piece would build, without list-of-lists boards.
+
+Usage:
+    python TeekoRecords.py convert games.txt games.tkg   # from TeekoArena --records
+    python TeekoRecords.py index games.tkg
+    python TeekoRecords.py query games.tkg "r ...../.b.../..r../...../....."
+    python TeekoRecords.py bench games.tkg
+"""
+import argparse
+import bisect
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+from TeekoGame import (ADJACENT, BOARD_SIZE, NUM_CELLS, PIECES_PER_SIDE, GameState, Move,
+                       board_from_bits)
+
+UNFINISHED, BLACK_WINS, RED_WINS, DRAW = range(4)
+RESULT_NAMES = ('*', '1-0', '0-1', '1/2-1/2')
+
+DROP_PLIES = 2 * PIECES_PER_SIDE
+# Cell index offsets of the eight neighbours, in slide-code order
+DIRECTIONS = (-BOARD_SIZE - 1, -BOARD_SIZE, -BOARD_SIZE + 1, -1, 1,
+              BOARD_SIZE - 1, BOARD_SIZE, BOARD_SIZE + 1)
+
+
+def _slide_tables():
+    codes = {}
+    moves = [None] * (NUM_CELLS * len(DIRECTIONS))
+    for src in range(NUM_CELLS):
+        for direction, offset in enumerate(DIRECTIONS):
+            dst = src + offset
+            if 0 <= dst < NUM_CELLS and ADJACENT[src] >> dst & 1:
+                code = src * len(DIRECTIONS) + direction
+                codes[src, dst] = code
+                moves[code] = Move(src, dst)
+    return codes, tuple(moves)
+
+
+SLIDE_CODES, SLIDE_MOVES = _slide_tables()
+DROP_MOVES = tuple(Move(None, cell) for cell in range(NUM_CELLS))
+# What each code does to the mover's bitboard; a drop sets one bit and a slide
+# flips two, so replay is a single XOR either way.
+DROP_BITS = tuple(1 << cell for cell in range(NUM_CELLS))
+SLIDE_BITS = tuple(0 if move is None else 1 << move.src | 1 << move.dst for move in SLIDE_MOVES)
+
+
+def encode_moves(moves):
+    """ Packs a game's moves into one byte each.
+
+    Args:
+        moves (list): Move or (src, dst) pairs, or moves in TeekoPlayer's list format
+
+    Returns:
+        bytes: the encoded moves
+
+    Raises:
+        ValueError: if a move does not fit the phase or is not a one-step slide
+    """
+    data = bytearray()
+    for ply, move in enumerate(moves):
+        if not (isinstance(move, tuple) and len(move) == 2
+                and all(cell is None or isinstance(cell, int) for cell in move)):
+            move = Move.from_list(move)
+        src, dst = move
+        if ply < DROP_PLIES:
+            if src is not None or not 0 <= dst < NUM_CELLS:
+                raise ValueError("move %d must be a drop, got %r" % (ply, move))
+            data.append(dst)
+        else:
+            code = SLIDE_CODES.get((src, dst))
+            if code is None:
+                raise ValueError("move %d must be a one-step slide, got %r" % (ply, move))
+            data.append(code)
+    return bytes(data)
+
+
+def decode_moves(data):
+    """ Inverse of encode_moves
+
+    Returns:
+        list: Move objects
+    """
+    moves = []
+    for ply, code in enumerate(data):
+        move = DROP_MOVES[code] if ply < DROP_PLIES and code < NUM_CELLS else None
+        if ply >= DROP_PLIES and code < len(SLIDE_MOVES):
+            move = SLIDE_MOVES[code]
+        if move is None:
+            raise ValueError("bad move code %d at move %d" % (code, ply))
+        moves.append(move)
+    return moves
+
+
+def replay(data):
+    """ Replays encoded moves.
+
+    Yields:
+        tuple: (black, red) bitboards after every move
+    """
+    bits = [0, 0]
+    for ply, code in enumerate(data):
+        bits[ply & 1] ^= DROP_BITS[code] if ply < DROP_PLIES else SLIDE_BITS[code]
+        yield bits[0], bits[1]
+
+
+def position_key(black, red, side):
+    """ The index key of a position: the two bitboards and the side to move
+    packed into one integer, so different positions never share a key.
+    """
+    return (black << NUM_CELLS | red) << 1 | side
+
+
+class GameRecord(namedtuple('GameRecord', ['offset', 'result', 'data'])):
+    """ One stored game: its offset in the file, its result and its encoded moves """
+
+    __slots__ = ()
+
+    def moves(self):
+        """ The moves as Move objects """
+        return decode_moves(self.data)
+
+    def positions(self):
+        """ (black, red, side to move) after every move """
+        for ply, (black, red) in enumerate(replay(self.data)):
+            yield black, red, (ply + 1) & 1
+
+    @property
+    def end(self):
+        """ The offset just past this record """
+        return self.offset + len(_write_varint(len(self.data))) + 1 + len(self.data)
+
+    def board_at(self, plies):
+        """ The list-of-lists board after the first plies moves """
+        black = red = 0
+        for black, red in replay(self.data[:plies]):
+            pass
+        return board_from_bits(black, red)
+
+
+def _write_varint(value):
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+    return data
+
+
+class GameWriter:
+    """ Appends games to a record file """
+
+    HEADER = struct.Struct('<4sHHI')
+    MAGIC = b'TKGR'
+    VERSION = 1
+
+    def __init__(self, f, validate=True):
+        """
+        Args:
+            f: binary file object positioned at its end (or at 0 for a new file)
+            validate (bool): replay every game with GameState first, so that only
+                legal games are stored
+        """
+        self.file = f
+        self.validate = validate
+        self.count = 0
+        if f.tell() == 0:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, 0))
+
+    @classmethod
+    def open(cls, path, validate=True):
+        """ Opens path for appending, creating it if needed.
+
+        An existing file is read through once to count its games. A partial
+        record at its end, left by a writer that did not finish, is cut off so
+        that new games follow the last complete one.
+        """
+        if os.path.exists(path) and os.path.getsize(path):
+            f = open(path, 'r+b')
+            reader = GameReader(f)
+            count, end = 0, f.tell()
+            for _ in reader:
+                count += 1
+                end = f.tell()
+            f.seek(end)
+            f.truncate()
+            writer = cls(f, validate)
+            writer.count = count
+            return writer
+        return cls(open(path, 'wb'), validate)
+
+    def write(self, moves, result=UNFINISHED):
+        """ Stores one game.
+
+        Args:
+            moves (list): the game's moves in any format encode_moves takes
+            result (int): UNFINISHED, BLACK_WINS, RED_WINS or DRAW
+
+        Returns:
+            int: the record's offset, as used by GameReader.read_at and GameIndex
+        """
+        if self.validate:
+            game = GameState()
+            for move in moves:
+                game.play(move)
+        data = encode_moves(moves)
+        offset = self.file.tell()
+        self.file.write(_write_varint(len(data)) + bytes((result,)) + data)
+        self.count += 1
+        return offset
+
+    def close(self):
+        if self.file.seekable():
+            end = self.file.tell()
+            self.file.seek(0)
+            self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, self.count & 0xFFFFFFFF))
+            self.file.seek(end)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _read_header(f, name):
+    header = f.read(GameWriter.HEADER.size)
+    if len(header) < GameWriter.HEADER.size:
+        raise ValueError("%s is not a Teeko game record file" % name)
+    magic, version, flags, count = GameWriter.HEADER.unpack(header)
+    if magic != GameWriter.MAGIC or version != GameWriter.VERSION:
+        raise ValueError("%s is not a Teeko game record file" % name)
+    return count
+
+
+class GameReader:
+    """ Streams the games of a record file """
+
+    def __init__(self, f):
+        """
+        Args:
+            f: binary file object at the start of a record file
+        """
+        self.file = f
+        self.count = _read_header(f, getattr(f, 'name', 'input'))
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, 'rb'))
+
+    def _read(self):
+        f = self.file
+        offset = f.tell()
+        plies = shift = 0
+        while True:
+            byte = f.read(1)
+            if not byte:
+                return None
+            plies |= (byte[0] & 0x7F) << shift
+            shift += 7
+            if byte[0] < 0x80:
+                break
+        data = f.read(plies + 1)
+        if len(data) < plies + 1:
+            # a record still being written
+            return None
+        return GameRecord(offset, data[0], data[1:])
+
+    def __iter__(self):
+        while True:
+            record = self._read()
+            if record is None:
+                return
+            yield record
+
+    def read_at(self, offset):
+        """ Reads the game stored at offset """
+        self.file.seek(offset)
+        record = self._read()
+        if record is None:
+            raise ValueError("no game at offset %d" % offset)
+        return record
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameIndex:
+    """ The games of a record file, by the positions they reach.
+
+    Attributes:
+        keys (array): position_key of every (position, game) pair, sorted
+        offsets (array): the game offset belonging to each key
+        size (int): length of the record file the index was built from
+    """
+
+    HEADER = struct.Struct('<4sHHQQ')
+    MAGIC = b'TKGI'
+    VERSION = 2
+
+    def __init__(self, keys, offsets, size=0):
+        self.keys = keys
+        self.offsets = offsets
+        self.size = size
+
+    @classmethod
+    def build(cls, records):
+        """ Indexes every game in records (a GameReader or an iterable of
+        GameRecord). A position is listed once per game however often the game
+        reaches it.
+        """
+        pairs = []
+        size = GameWriter.HEADER.size
+        for record in records:
+            size = max(size, record.end)
+            seen = set()
+            offset = record.offset
+            for ply, (black, red) in enumerate(replay(record.data)):
+                key = position_key(black, red, (ply + 1) & 1)
+                if key not in seen:
+                    seen.add(key)
+                    pairs.append((key, offset))
+        pairs.sort()
+        return cls(array('Q', (key for key, _ in pairs)), array('Q', (offset for _, offset in pairs)), size)
+
+    @staticmethod
+    def path_for(records_path):
+        return records_path + '.idx'
+
+    def save(self, path):
+        keys, offsets = array('Q', self.keys), array('Q', self.offsets)
+        if sys.byteorder != 'little':
+            keys.byteswap()
+            offsets.byteswap()
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, len(keys), self.size))
+            f.write(keys.tobytes())
+            f.write(offsets.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """ Reads an index file; raises ValueError if it is not one """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(path + " is not a Teeko game index")
+        magic, version, flags, count, size = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION or len(data) != cls.HEADER.size + 16 * count:
+            raise ValueError(path + " is not a Teeko game index")
+        keys, offsets = array('Q'), array('Q')
+        keys.frombytes(data[cls.HEADER.size:cls.HEADER.size + 8 * count])
+        offsets.frombytes(data[cls.HEADER.size + 8 * count:])
+        if sys.byteorder != 'little':
+            keys.byteswap()
+            offsets.byteswap()
+        return cls(keys, offsets, size)
+
+    @classmethod
+    def open(cls, records_path):
+        """ The index of a record file, read from its .idx file if that still
+        matches the records, and otherwise built afresh and saved.
+        """
+        path = cls.path_for(records_path)
+        try:
+            index = cls.load(path)
+        except (OSError, ValueError):
+            index = None
+        if index is None or index.size != os.path.getsize(records_path):
+            with GameReader.open(records_path) as reader:
+                index = cls.build(reader)
+            index.save(path)
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, black, red, side):
+        """ Offsets of the games reaching a position.
+
+        Args:
+            black (int): bitboard of black's pieces
+            red (int): bitboard of red's pieces
+            side (int): 0 if black is to move, 1 if red is
+
+        Returns:
+            list: record offsets, in file order
+        """
+        key = position_key(black, red, side)
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return list(self.offsets[lo:hi])
+
+
+def parse_position(text):
+    """ Reads "<side> <rows>" as in benchmark_positions.txt, e.g.
+    "r ...../.b.../..r../...../.....", into (black, red, side).
+    """
+    fields = text.split()
+    if len(fields) != 2:
+        raise ValueError("malformed position %r" % text)
+    piece, rows = fields[0], fields[1].split('/')
+    if piece not in ('b', 'r') or len(rows) != BOARD_SIZE or any(len(row) != BOARD_SIZE for row in rows):
+        raise ValueError("malformed position %r" % text)
+    state = [[' ' if cell == '.' else cell for cell in row] for row in rows]
+    game = GameState.from_board(state, piece)
+    return game.black, game.red, game.side
+
+
+ARENA_RESULTS = {'1-0': BLACK_WINS, '0-1': RED_WINS, '1/2-1/2': DRAW}
+
+
+def parse_arena_record(line):
+    """ Reads one line of TeekoArena's --records output.
+
+    Returns:
+        tuple: (moves in TeekoPlayer's list format, result)
+    """
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 7:
+        raise ValueError("malformed arena record %r" % line)
+    moves = []
+    for text in fields[6].split():
+        cells = [(int(text[i + 1]), ord(text[i]) - ord('A')) for i in range(0, len(text), 2)]
+        moves.append(cells[::-1])
+    return moves, ARENA_RESULTS.get(fields[3], UNFINISHED)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help="convert TeekoArena text records")
+    convert.add_argument('text')
+    convert.add_argument('records')
+    index = commands.add_parser('index', help="build the position index of a record file")
+    index.add_argument('records')
+    query = commands.add_parser('query', help="list the games reaching a position")
+    query.add_argument('records')
+    query.add_argument('position')
+    bench = commands.add_parser('bench', help="time reading and replaying a record file")
+    bench.add_argument('records')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        with open(args.text) as f, GameWriter.open(args.records) as writer:
+            for line in f:
+                if line.strip():
+                    writer.write(*parse_arena_record(line))
+            print("%s: %d games" % (args.records, writer.count))
+    elif args.command == 'index':
+        with GameReader.open(args.records) as reader:
+            index = GameIndex.build(reader)
+        index.save(GameIndex.path_for(args.records))
+        print("indexed %d positions" % len(index))
+    elif args.command == 'query':
+        try:
+            black, red, side = parse_position(args.position)
+        except ValueError as e:
+            parser.error(str(e))
+        index = GameIndex.open(args.records)
+        with GameReader.open(args.records) as reader:
+            for offset in index.lookup(black, red, side):
+                record = reader.read_at(offset)
+                print("%d\t%s\t%d" % (offset, RESULT_NAMES[record.result], len(record.data)))
+    else:
+        start = time.perf_counter()
+        with GameReader.open(args.records) as reader:
+            records = list(reader)
+        read = time.perf_counter() - start
+        start = time.perf_counter()
+        plies = 0
+        for record in records:
+            for _ in replay(record.data):
+                plies += 1
+        replayed = time.perf_counter() - start
+        size = os.path.getsize(args.records)
+        print("%d games, %d moves, %.2f bytes/move" % (len(records), plies, size / max(plies, 1)))
+        print("read %.0f games/s, replay %.0f moves/s" % (len(records) / read, plies / replayed))
+
+
+if __name__ == "__main__":
+    main()
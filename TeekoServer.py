@@ -0,0 +1,474 @@
+""" Asyncio game server for the Teeko engine, speaking line-delimited JSON over TCP.
+
+Every request is one JSON object on one line, and every response is one line
+with the same "id". Responses to pipelined requests can come back out of order.
+
+    {"id": 1, "op": "new"}
+    {"id": 2, "op": "move", "game": 0, "move": [[2, 2]]}
+    {"id": 3, "op": "engine", "game": 0, "deadline": 2.0}
+    {"id": 4, "op": "state", "game": 0}
+    {"id": 5, "op": "end", "game": 0}
+
+Moves use TeekoPlayer's format: [[row, col]] for a drop and
+[[row, col], [source_row, source_col]] for a slide. "move" is checked like
+TeekoPlayer.opponent_move, and "engine" has the engine move for the side to
+move. A successful response has "ok": true plus the game's state:
+    {"id": 3, "ok": true, "game": 0, "board": "..........b.r............",
+     "turn": "b", "plies": 2, "winner": null, "move": [[1, 1]], "moves": [...]}
+"board" lists the 25 cells row by row ('b', 'r' or '.'), and "moves" lists the
+legal moves of the side to move. A failure has "ok": false and an "error".
+
+Engine moves run in a process pool (a single thread with --workers 0), so the
+event loop never blocks on a search. Load is bounded in three ways:
+    - at most --max-pending engine moves are queued or running; past that,
+      requests fail at once with "overloaded" for the client to retry;
+    - each connection has at most --max-inflight requests in progress; the
+      server stops reading from it until one finishes, so TCP pushes back on
+      the client;
+    - at most --max-games games exist at once.
+An engine request can carry a "deadline" in seconds. The search is shortened to
+fit, and if no move is ready in time the request fails with "deadline exceeded"
+and the game is unchanged.
+
+Usage:
+    python TeekoServer.py serve [--port 7878] [--workers N] [--time 0.5]
+    python TeekoServer.py bench [--clients 32] [--games 4] [--time 0.05]
+
+bench starts a server in the same process and lets a number of local clients
+play it, each taking random legal moves for one side. It reports throughput and
+latency percentiles.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from TeekoGame import BOARD_SIZE, GameState, SessionManager, move_from_indices
+
+logger = logging.getLogger(__name__)
+
+PORT = 7878
+# Time kept back from a request's deadline for getting the answer back to the
+# event loop.
+DEADLINE_MARGIN = 0.02
+
+_worker_sessions = None
+
+
+def _worker_init(time_limit):
+    global _worker_sessions
+    _worker_sessions = SessionManager(time_limit, tt_size_mb=16)
+
+
+def choose_move(sessions, black, red, side, time_limit, deadline):
+    """ Picks a move with sessions' engine. deadline is an absolute time.time(),
+    so time spent waiting in the executor's queue is taken off the search.
+
+    Returns:
+        tuple: the (src, dst) move, or None if the deadline has already passed
+    """
+    if deadline is not None:
+        time_limit = min(time_limit, deadline - time.time() - DEADLINE_MARGIN)
+        if time_limit <= 0:
+            return None
+    return tuple(sessions.choose_move(GameState(black, red, side), time_limit))
+
+
+def _worker_choose(*args):
+    return choose_move(_worker_sessions, *args)
+
+
+class RequestError(Exception):
+    """ A request the server refused; the message goes back to the client """
+
+
+def state_response(game_id, game, move=None):
+    board = ['.'] * (BOARD_SIZE * BOARD_SIZE)
+    for cell in range(len(board)):
+        if game.black >> cell & 1:
+            board[cell] = 'b'
+        elif game.red >> cell & 1:
+            board[cell] = 'r'
+    winner = game.winner()
+    response = {'game': game_id, 'board': ''.join(board), 'turn': game.piece,
+                'plies': game.plies, 'winner': winner,
+                'moves': [] if winner else [move_from_indices(*m) for m in game.moves()]}
+    if move is not None:
+        response['move'] = move_from_indices(*move)
+    return response
+
+
+class TeekoServer:
+    """ Hosts games for any number of TCP clients.
+
+    Attributes:
+        sessions (SessionManager): the games
+        pending (int): engine moves queued or running
+    """
+
+    def __init__(self, workers=None, time_limit=0.5, max_pending=64, max_inflight=8,
+                 max_games=10000):
+        """
+        Args:
+            workers (int): engine processes; 0 searches in one thread of this
+                process instead; defaults to the number of CPUs
+            time_limit (float): seconds per engine move when the deadline allows
+            max_pending (int): engine moves allowed to be queued or running
+            max_inflight (int): requests in progress per connection
+            max_games (int): games allowed to exist at once
+        """
+        # With a process pool the workers search, and this manager only holds
+        # the games; it never creates its player.
+        self.sessions = SessionManager(time_limit)
+        self.time_limit = time_limit
+        self.max_pending = max_pending
+        self.max_inflight = max_inflight
+        self.max_games = max_games
+        self.pending = 0
+        self._busy = set()
+        self._connections = {}
+        if workers == 0:
+            self.executor = ThreadPoolExecutor(1)
+        else:
+            self.executor = ProcessPoolExecutor(workers or os.cpu_count() or 1,
+                                                initializer=_worker_init, initargs=(time_limit,))
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=PORT):
+        """ Starts listening; port 0 picks a free port.
+
+        Returns:
+            int: the port
+        """
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """ Stops listening, hangs up on every client and shuts the executor down """
+        if self._server is not None:
+            self._server.close()
+        for writer in self._connections:
+            writer.close()
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        inflight = asyncio.Semaphore(self.max_inflight)
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(line):
+            try:
+                response = await self.dispatch(line)
+                async with write_lock:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+            except (ConnectionError, RuntimeError):
+                # the client hung up, or close() closed the transport
+                pass
+            finally:
+                inflight.release()
+
+        try:
+            while True:
+                await inflight.acquire()
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break
+                if not line:
+                    break
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+    async def dispatch(self, line):
+        """ Answers one request line with a response dict """
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise RequestError("malformed JSON")
+            if not isinstance(request, dict):
+                raise RequestError("a request must be a JSON object")
+            request_id = request.get('id')
+            response = await self._execute(request)
+        except RequestError as e:
+            response = {'ok': False, 'error': str(e)}
+        except Exception:
+            # a bug, not a bad request; the client still gets its answer
+            logger.exception("request %r failed", line)
+            response = {'ok': False, 'error': "internal error"}
+        else:
+            response['ok'] = True
+        response['id'] = request_id
+        return response
+
+    def _game(self, request):
+        game_id = request.get('game')
+        try:
+            return game_id, self.sessions.games[game_id]
+        except (KeyError, TypeError):
+            raise RequestError("no game %r" % (game_id,))
+
+    async def _execute(self, request):
+        op = request.get('op')
+        if op == 'new':
+            if len(self.sessions) >= self.max_games:
+                raise RequestError("too many games")
+            game_id = self.sessions.new_game()
+            return state_response(game_id, self.sessions.games[game_id])
+        game_id, game = self._game(request)
+        if op == 'state':
+            return state_response(game_id, game)
+        if op == 'end':
+            if game_id in self._busy:
+                raise RequestError("game busy")
+            self.sessions.end_game(game_id)
+            return {'game': game_id}
+        if op == 'move':
+            if game_id in self._busy:
+                raise RequestError("game busy")
+            try:
+                move = game.play(request.get('move'))
+            except ValueError as e:
+                raise RequestError(str(e))
+            return state_response(game_id, game, move)
+        if op == 'engine':
+            move = await self._engine_move(game_id, game, request.get('deadline'))
+            return state_response(game_id, game, move)
+        raise RequestError("unknown op %r" % (op,))
+
+    def _job_done(self):
+        self.pending -= 1
+
+    @staticmethod
+    def _call_soon(loop, callback):
+        """ Runs callback on loop from an executor thread, unless the loop is gone """
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass
+
+    async def _engine_move(self, game_id, game, deadline):
+        if game.winner() is not None:
+            raise RequestError("The game is over")
+        if game_id in self._busy:
+            raise RequestError("game busy")
+        if self.pending >= self.max_pending:
+            raise RequestError("overloaded")
+        if deadline is not None and (isinstance(deadline, bool) or not isinstance(deadline, (int, float))
+                                     or not 0 < deadline <= sys.float_info.max):
+            # the upper bound rejects inf, and NaN fails both comparisons
+            raise RequestError("deadline must be a positive number of seconds")
+        args = (game.black, game.red, game.side, self.time_limit,
+                None if deadline is None else time.time() + deadline)
+        if isinstance(self.executor, ThreadPoolExecutor):
+            call = (choose_move, self.sessions) + args
+        else:
+            call = (_worker_choose,) + args
+        loop = asyncio.get_running_loop()
+        job = self.executor.submit(*call)
+        # The job stays counted until it has really finished: a search that
+        # missed its deadline still holds a worker.
+        self.pending += 1
+        job.add_done_callback(lambda _: self._call_soon(loop, self._job_done))
+        self._busy.add(game_id)
+        try:
+            try:
+                move = await asyncio.wait_for(asyncio.wrap_future(job), deadline)
+            except asyncio.TimeoutError:
+                move = None
+            if move is None:
+                raise RequestError("deadline exceeded")
+        finally:
+            self._busy.discard(game_id)
+        if game_id not in self.sessions:
+            raise RequestError("no game %r" % (game_id,))
+        return game.play(move)
+
+
+class TeekoClient:
+    """ Minimal client for TeekoServer, e.g. to stand in for players in tests.
+
+    Requests can be issued concurrently; responses are matched up by id.
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._waiting = {}
+        self._receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=PORT):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _receive(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._waiting.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection closed"))
+
+    async def request(self, op, **fields):
+        """ Sends a request and waits for its response.
+
+        Returns:
+            dict: the response
+
+        Raises:
+            RequestError: if the server refused the request
+        """
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        fields.update(id=request_id, op=op)
+        self._writer.write(json.dumps(fields).encode() + b'\n')
+        await self._writer.drain()
+        response = await future
+        if not response['ok']:
+            raise RequestError(response['error'])
+        return response
+
+    async def close(self):
+        self._writer.close()
+        self._receiver.cancel()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float('nan')
+
+
+async def _bench_client(port, games, deadline, latencies, errors, rng):
+    client = await TeekoClient.connect(port=port)
+
+    async def timed(op, **fields):
+        start = time.perf_counter()
+        try:
+            return await client.request(op, **fields)
+        except RequestError as e:
+            errors[str(e)] = errors.get(str(e), 0) + 1
+            return None
+        finally:
+            latencies.setdefault(op, []).append(time.perf_counter() - start)
+
+    try:
+        for number in range(games):
+            state = await timed('new')
+            if state is None:
+                continue
+            game_id = state['game']
+            engine_side = 'br'[number % 2]
+            while state['winner'] is None and state['plies'] < 60:
+                if state['turn'] == engine_side:
+                    response = await timed('engine', game=game_id, deadline=deadline)
+                else:
+                    response = await timed('move', game=game_id, move=rng.choice(state['moves']))
+                if response is None:
+                    response = await timed('state', game=game_id)
+                state = response
+            await timed('end', game=game_id)
+    finally:
+        await client.close()
+
+
+async def bench(clients=32, games=4, workers=None, time_limit=0.05, deadline=2.0, seed=0):
+    """ Plays clients * games games against a fresh in-process server.
+
+    Returns:
+        tuple: (latencies by op, errors by message, elapsed seconds)
+    """
+    server = TeekoServer(workers, time_limit, max_pending=4 * clients)
+    port = await server.start(port=0)
+    latencies, errors = {}, {}
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(_bench_client(port, games, deadline, latencies, errors,
+                                             random.Random(rng.random()))
+                               for _ in range(clients)))
+    finally:
+        await server.close()
+    return latencies, errors, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=PORT)
+    serve_parser.add_argument('--workers', type=int)
+    serve_parser.add_argument('--time', type=float, default=0.5)
+    serve_parser.add_argument('--max-pending', type=int, default=64)
+    serve_parser.add_argument('--max-inflight', type=int, default=8)
+    serve_parser.add_argument('--max-games', type=int, default=10000)
+    bench_parser = commands.add_parser('bench')
+    bench_parser.add_argument('--clients', type=int, default=32)
+    bench_parser.add_argument('--games', type=int, default=4, help="games per client")
+    bench_parser.add_argument('--workers', type=int)
+    bench_parser.add_argument('--time', type=float, default=0.05)
+    bench_parser.add_argument('--deadline', type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        async def serve():
+            server = TeekoServer(args.workers, args.time, args.max_pending, args.max_inflight,
+                                 args.max_games)
+            port = await server.start(args.host, args.port)
+            print("listening on %s:%d" % (args.host, port), file=sys.stderr)
+            try:
+                await server.serve_forever()
+            finally:
+                await server.close()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    latencies, errors, elapsed = asyncio.run(
+        bench(args.clients, args.games, args.workers, args.time, args.deadline))
+    total = sum(len(values) for values in latencies.values())
+    print("%d requests in %.2f s: %.1f requests/s" % (total, elapsed, total / elapsed))
+    for op in sorted(latencies):
+        values = latencies[op]
+        print("%-7s %6d  p50 %7.1f ms  p99 %7.1f ms  max %7.1f ms"
+              % (op, len(values), 1000 * percentile(values, 0.5), 1000 * percentile(values, 0.99),
+                 1000 * max(values)))
+    for message, count in sorted(errors.items()):
+        print("error %r: %d" % (message, count))
+
+
+if __name__ == "__main__":
+    main()
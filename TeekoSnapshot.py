@@ -0,0 +1,27 @@
+""" Saves TeekoGame's precomputed lookup tables so that importing it loads them
+instead of building them.
+
+The snapshot is tied to the exact TeekoGame.py source and Python version that
+wrote it. After either changes it is ignored, and the tables are built as if it
+were not there, until this script is run again.
+
+Usage:
+    python TeekoSnapshot.py [--output teeko_tables.bin]
+"""
+import argparse
+import os
+
+import TeekoGame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         TeekoGame.TABLES_FILE))
+    args = parser.parse_args(argv)
+    count = TeekoGame.save_tables(args.output)
+    print("wrote %d tables (%d bytes) to %s" % (count, os.path.getsize(args.output), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+""" Offline builder for the Teeko move-phase tablebase read by TeekoGame.Tablebase.
+
+The table is solved by retrograde analysis. Positions in which the side to move
+has already lost (the other side holds a winning pattern) are distance 0. From
+every position solved at distance d the builder walks back over the moves that
+could have led to it:
+    - a predecessor of a loss is a win at distance d + 1;
+    - a predecessor of a win has one more of its moves refuted, and once all of
+      them are it becomes a loss at distance d + 1.
+Positions never reached this way are draws. Only solved positions and their
+predecessors are ever touched, so no pass over the full index space is needed.
+
+Usage:
+    python TeekoTablebase.py [--output teeko_tablebase.bin] [--max-distance N]
+
+A full build takes hours in CPython and about 150 MB of memory; --max-distance
+stops early and writes a partial table whose unsolved entries are left for the
+search.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from array import array
+
+from TeekoGame import (ADJACENT, FULL_BOARD, NUM_CELLS, PIECES_PER_SIDE, TABLEBASE_FILE,
+                       TABLEBASE_SIZE, WIN_MASKS, Tablebase, bb_is_win, iter_bits,
+                       tablebase_index)
+
+MAX_DISTANCE = 254  # distance + 1 must fit in a byte
+
+
+def _pack(mover, other):
+    return mover << NUM_CELLS | other
+
+
+def _unpack(packed):
+    return packed >> NUM_CELLS, packed & FULL_BOARD
+
+
+def _count_moves(mover, other):
+    empty = FULL_BOARD & ~(mover | other)
+    return sum((ADJACENT[src] & empty).bit_count() for src in iter_bits(mover))
+
+
+def terminal_losses(values):
+    """ Marks every position whose side to move has already lost (distance 0).
+
+    Returns:
+        array: the packed positions that were marked
+    """
+    level = array('Q')
+    for mask in WIN_MASKS:
+        free = [cell for cell in range(NUM_CELLS) if not mask >> cell & 1]
+        for cells in itertools.combinations(free, PIECES_PER_SIDE):
+            mover = sum(1 << cell for cell in cells)
+            if bb_is_win(mover):
+                continue  # both sides cannot have won
+            values[tablebase_index(mover, mask)] = 1
+            level.append(_pack(mover, mask))
+    return level
+
+
+def retrograde(values, level, max_distance=MAX_DISTANCE, log=None):
+    """ Solves outwards from the positions in level, which are at distance 0.
+
+    Args:
+        values (bytearray): one byte per tablebase index, filled in place
+        level (array): packed positions solved at distance 0
+        max_distance (int): stop after solving this distance
+        log (callable): optional progress callback taking a message
+
+    Returns:
+        tuple: (complete, reached) where complete is True if every position
+            that can be solved was solved, and reached is the largest distance
+            written
+    """
+    counters = bytearray(TABLEBASE_SIZE)  # remaining unrefuted moves + 1, 0 = not yet counted
+    distance = 0
+    while level:
+        if distance >= max_distance:
+            return False, distance
+        start = time.time()
+        next_level = array('Q')
+        byte = distance + 2
+        loss = not distance & 1
+        for packed in level:
+            mover, other = _unpack(packed)
+            empty = FULL_BOARD & ~(mover | other)
+            # undo the other side's last move: a piece on dst came from an adjacent src
+            for dst in iter_bits(other):
+                for src in iter_bits(ADJACENT[dst] & empty):
+                    prev = other ^ (1 << dst | 1 << src)
+                    if bb_is_win(prev):
+                        continue  # the game would already have ended
+                    index = tablebase_index(prev, mover)
+                    if values[index]:
+                        continue
+                    if loss:
+                        values[index] = byte
+                        next_level.append(_pack(prev, mover))
+                    else:
+                        remaining = counters[index] or _count_moves(prev, mover) + 1
+                        remaining -= 1
+                        counters[index] = remaining
+                        if remaining == 1:
+                            values[index] = byte
+                            next_level.append(_pack(prev, mover))
+        distance += 1
+        if log is not None:
+            log("distance %d: %d %s in %.1fs" % (distance, len(next_level),
+                                                 "wins" if loss else "losses", time.time() - start))
+        level = next_level
+    return True, distance - 1
+
+
+def write_tablebase(path, values, complete, max_distance):
+    """ Writes values with a Tablebase header, atomically replacing path """
+    flags = Tablebase.FLAG_COMPLETE if complete else 0
+    header = Tablebase.HEADER.pack(Tablebase.MAGIC, Tablebase.VERSION, flags,
+                                   max_distance, TABLEBASE_SIZE)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(values)
+    os.replace(tmp, path)
+
+
+def build(path, max_distance=MAX_DISTANCE, log=None):
+    """ Solves the move phase and writes the tablebase to path.
+
+    Returns:
+        bool: whether the table is complete
+    """
+    values = bytearray(TABLEBASE_SIZE)
+    level = terminal_losses(values)
+    if log is not None:
+        log("distance 0: %d losses" % len(level))
+    complete, reached = retrograde(values, level, max_distance, log)
+    write_tablebase(path, values, complete, reached)
+    return complete
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         TABLEBASE_FILE))
+    parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE)
+    args = parser.parse_args(argv)
+    complete = build(args.output, min(args.max_distance, MAX_DISTANCE),
+                     log=lambda msg: print(msg, file=sys.stderr))
+    print("wrote %s (%s)" % (args.output, "complete" if complete else "partial"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+""" Checks that the vectorised evaluation in TeekoAnalysis agrees exactly with
+the scalar functions it reproduces.
+
+Run with:
+    python -m unittest test_analysis      (or python -m pytest)
+"""
+import random
+import unittest
+
+import TeekoAnalysis
+from TeekoAnalysis import BLACK, EMPTY, RED
+from TeekoGame import (NUM_CELLS, PIECES_PER_SIDE, TeekoPlayer, bb_apply, bb_heuristic, bb_is_win,
+                       bb_moves, bb_wins_at, board_from_bits)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SEED = 20240611
+BOARDS = 2000
+
+
+def random_position(rng):
+    """ (black, red) bitboards with 0-4 pieces each, picked at random """
+    cells = rng.sample(range(NUM_CELLS), rng.randint(0, PIECES_PER_SIDE) + rng.randint(0, PIECES_PER_SIDE))
+    split = rng.randint(max(0, len(cells) - PIECES_PER_SIDE), min(len(cells), PIECES_PER_SIDE))
+    return sum(1 << cell for cell in cells[:split]), sum(1 << cell for cell in cells[split:])
+
+
+def player(piece):
+    result = TeekoPlayer()
+    result.my_piece = piece
+    result.opp = 'r' if piece == 'b' else 'b'
+    return result
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class BatchEvaluationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(SEED)
+        cls.positions = [random_position(rng) for _ in range(BOARDS)]
+        cls.states = [board_from_bits(black, red) for black, red in cls.positions]
+        cls.boards = TeekoAnalysis.encode_boards(cls.states)
+
+    def test_positions_include_wins(self):
+        wins = sum(bb_is_win(black) or bb_is_win(red) for black, red in self.positions)
+        self.assertGreater(wins, 0)
+
+    def test_encode_boards(self):
+        for (black, red), row in zip(self.positions, self.boards):
+            for cell in range(NUM_CELLS):
+                expected = BLACK if black >> cell & 1 else RED if red >> cell & 1 else EMPTY
+                self.assertEqual(row[cell], expected)
+
+    def test_game_value_matches_player(self):
+        counts = TeekoAnalysis.batch_line_counts(self.boards)
+        for piece in 'br':
+            expected = [player(piece).game_value(state) for state in self.states]
+            self.assertEqual(TeekoAnalysis.batch_game_value(self.boards, piece).tolist(), expected)
+            self.assertEqual(TeekoAnalysis.batch_game_value(self.boards, piece, counts).tolist(), expected)
+
+    def test_heuristic_matches_player(self):
+        for piece, code in (('b', BLACK), ('r', RED)):
+            expected = [player(piece).heuristic_game_value(state) for state in self.states]
+            self.assertEqual(TeekoAnalysis.batch_heuristic(self.boards, piece).tolist(), expected)
+            self.assertEqual(TeekoAnalysis.batch_heuristic(self.boards, code).tolist(), expected)
+
+    def test_expand_ply_matches_bitboards(self):
+        checked = 0
+        for black, red in self.positions[:200]:
+            if bb_is_win(black) or bb_is_win(red):
+                continue
+            for mine, theirs in ((black, red), (red, black)):
+                moves, boards = TeekoAnalysis.expand_ply(mine, theirs)
+                self.assertEqual(list(moves), list(bb_moves(mine, theirs)))
+                values = TeekoAnalysis.batch_game_value(boards, BLACK).tolist()
+                heuristics = TeekoAnalysis.batch_heuristic(boards, BLACK).tolist()
+                for (src, dst), value, heuristic in zip(moves, values, heuristics):
+                    child = bb_apply(mine, src, dst)
+                    self.assertEqual(value, 1 if bb_wins_at(child, dst) else 0)
+                    self.assertEqual(heuristic, bb_heuristic(child, theirs))
+                    checked += 1
+        self.assertGreater(checked, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
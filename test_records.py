@@ -0,0 +1,88 @@
+""" Checks that TeekoRecords stores games faithfully and keeps a record file
+usable when it is appended to.
+
+Run with:
+    python -m unittest test_records      (or python -m pytest)
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from TeekoGame import GameState
+from TeekoRecords import BLACK_WINS, UNFINISHED, GameIndex, GameReader, GameWriter
+
+SEED = 20240702
+
+
+def random_game(rng, max_plies=40):
+    """ The moves of a random legal game, stopped at a win or after max_plies """
+    game = GameState()
+    moves = []
+    while len(moves) < max_plies and game.winner() is None:
+        move = rng.choice(game.moves())
+        game.play(move)
+        moves.append(move)
+    return moves
+
+
+class GameFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'games.tkg')
+        rng = random.Random(SEED)
+        self.games = [random_game(rng) for _ in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, games):
+        with GameWriter.open(self.path) as writer:
+            for moves in games:
+                writer.write(moves, BLACK_WINS)
+        return writer.count
+
+    def read(self):
+        with GameReader.open(self.path) as reader:
+            return reader.count, [record.moves() for record in reader]
+
+    def test_round_trip(self):
+        self.assertEqual(self.write(self.games), len(self.games))
+        self.assertEqual(self.read(), (len(self.games), self.games))
+
+    def test_append(self):
+        self.write(self.games[:2])
+        self.assertEqual(self.write(self.games[2:]), len(self.games))
+        self.assertEqual(self.read(), (len(self.games), self.games))
+
+    def test_append_after_partial_record(self):
+        self.write(self.games[:2])
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        self.assertEqual(self.write(self.games[2:]), 3)
+        self.assertEqual(self.read(), (3, self.games[:1] + self.games[2:]))
+
+    def test_partial_record_is_not_read(self):
+        self.write(self.games[:2])
+        with open(self.path, 'ab') as f:
+            f.write(bytes((60, UNFINISHED)))
+        self.assertEqual(self.read(), (2, self.games[:2]))
+
+    def test_index_is_rebuilt_after_append(self):
+        self.write(self.games[:2])
+        GameIndex.open(self.path)
+        self.write(self.games[2:])
+        self.assertNotEqual(GameIndex.load(GameIndex.path_for(self.path)).size, os.path.getsize(self.path))
+        index = GameIndex.open(self.path)
+        self.assertEqual(index.size, os.path.getsize(self.path))
+        with GameReader.open(self.path) as reader:
+            records = list(reader)
+        for record in records:
+            black, red, side = list(record.positions())[-1]
+            self.assertIn(record.offset, index.lookup(black, red, side))
+
+
+if __name__ == '__main__':
+    unittest.main()